@@ -0,0 +1,119 @@
+
+from __future__ import annotations
+
+from collections import deque
+from dataclasses import dataclass
+import operator
+from typing import Any, Callable, Collection, Dict, Hashable, Iterable, List
+
+@dataclass
+class Alignment():
+    """Fields of samples joined onto target samples, e.g. sensor values onto GPS points
+
+    An as-of merge over the stream of samples of a log, in log order: each
+    channel carries the last value of a field, and a target gets the values
+    carried at it, those of its own sample included. Rows are yielded as
+    targets arrive, so that samples are never all held.
+    A channel may instead be interpolated in Time between its values around
+    a target, then rows wait for its next value (and keep their order).
+    Samples are read only through the functions given, so they may be
+    Log.Sample objects as well as dicts of the fields of sample elements.
+    """
+
+    @dataclass
+    class Channel():
+        """Field of the samples of some kinds (all if None), get returns its value in a sample, None if none"""
+
+        get: Callable[[Any], Any]
+        kinds: Collection[Hashable] | None = None
+        # Linear in Time between the values around targets, numbers only
+        interpolate: bool = False
+
+        @classmethod
+        def for_attr(cls, sample_cls: type, attr: str, interpolate: bool = False):
+            """Channel of an attribute of the Log.Sample objects of sample_cls, with Alignment.kind = type"""
+            return Alignment.Channel(operator.attrgetter(attr), frozenset([sample_cls]), interpolate)
+
+    # Key = name
+    channel_dict: Dict[str, Alignment.Channel]
+    is_target: Callable[[Any], bool]
+    # Kind of a sample, to only get channels of its kind
+    kind: Callable[[Any], Hashable] = type
+    # ms, sample Time base, only needed for interpolated channels
+    get_time: Callable[[Any], int] = operator.attrgetter("time")
+
+    def rows(self, samples: Iterable):
+        """Yield (target, {channel name: value at target}) of each target among samples, in their order"""
+
+        if any(channel.interpolate for channel in self.channel_dict.values()):
+            yield from self.interpolated_rows(samples)
+            return
+
+        name_list = list(self.channel_dict)
+        channel_list = list(self.channel_dict.values())
+        # Key = kind, value = (index, get) of the channels of samples of this kind
+        getter_list_dict: Dict[Hashable, List] = {}
+        values: List = [None] * len(channel_list)
+
+        for sample in samples:
+            kind = self.kind(sample)
+            getter_list = getter_list_dict.get(kind)
+            if getter_list is None:
+                getter_list = [(index, channel.get) for index, channel in enumerate(channel_list)
+                    if channel.kinds is None or kind in channel.kinds]
+                getter_list_dict[kind] = getter_list
+            for index, get in getter_list:
+                value = get(sample)
+                if value is not None:
+                    values[index] = value
+            if self.is_target(sample):
+                yield sample, dict(zip(name_list, values))
+
+    def interpolated_rows(self, samples: Iterable):
+        """rows(), with rows held until the next value of their interpolated channels"""
+
+        name_list = list(self.channel_dict)
+        channel_list = list(self.channel_dict.values())
+        getter_list_dict: Dict[Hashable, List] = {}
+        values: List = [None] * len(channel_list)
+        # Time of the value carried by each channel
+        time_list: List[int | None] = [None] * len(channel_list)
+        # [target, Time, values, indices of the channels still to interpolate], in order
+        pending = deque()
+
+        for sample in samples:
+            kind = self.kind(sample)
+            getter_list = getter_list_dict.get(kind)
+            if getter_list is None:
+                getter_list = [(index, channel.get, channel.interpolate) for index, channel in enumerate(channel_list)
+                    if channel.kinds is None or kind in channel.kinds]
+                getter_list_dict[kind] = getter_list
+            for index, get, interpolate in getter_list:
+                value = get(sample)
+                if value is None:
+                    continue
+                if interpolate:
+                    time = self.get_time(sample)
+                    previous_time = time_list[index]
+                    previous_value = values[index]
+                    for row in pending:
+                        if index in row[3]:
+                            row[3].discard(index)
+                            if time > previous_time:
+                                row[2][index] = (previous_value
+                                    + (value - previous_value) * (row[1] - previous_time) / (time - previous_time))
+                    time_list[index] = time
+                values[index] = value
+            if self.is_target(sample):
+                time = self.get_time(sample)
+                # Channels with a value before the target, and maybe one after
+                missing = {index for index, channel in enumerate(channel_list)
+                    if channel.interpolate and time_list[index] is not None and time_list[index] < time}
+                pending.append([sample, time, list(values), missing])
+            while pending and not pending[0][3]:
+                row = pending.popleft()
+                yield row[0], dict(zip(name_list, row[2]))
+
+        # No value after, the last one is carried
+        for row in pending:
+            yield row[0], dict(zip(name_list, row[2]))
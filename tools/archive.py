@@ -0,0 +1,323 @@
+#!/usr/bin/python
+
+""" Archive of decoded logs, for queries across many moves without parsing any log.
+usage: ./archive.py ARCHIVE_DIR add LOG_PATH [LOG_PATH ...]
+       ./archive.py ARCHIVE_DIR list
+       ./archive.py ARCHIVE_DIR scan TYPE FIELD
+"""
+
+from __future__ import annotations
+
+from argparse import ArgumentParser
+from array import array
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+import glob
+import json
+import logging
+import mmap
+import os
+import sys
+from typing import Dict, List
+
+from log import Log
+from filehash import file_sha256
+
+LOG_LEVEL_DEFAULT = logging.INFO
+LOG_LEVEL_VERBOSE = logging.DEBUG
+LOG_FMT = "[%(levelname)5s][%(name)12s] %(message)s"
+
+@dataclass
+class Archive():
+    """Log.Columns of many logs, one append-only file per column across all logs
+
+    A column file is named <sample type>.<field>.<data|mask|offsets> (see
+    Log.Columns), and holds the raw array of each move one after the other,
+    str columns being stored as a JSON list per move. The move table tells
+    where the arrays of each move are in these files.
+
+    Files are read through mmap, and views of the arrays are returned without
+    copying, so that a scan of a field only touches the pages of its file.
+    A log added again once changed gets a new move, the data of the previous
+    one is left unused in the files, and skipped by views.
+    """
+
+    FILE_NAME = "archive.json"
+
+    @dataclass
+    class Move():
+        log_file_path: str
+        size: int
+        mtime_ns: int
+        sha256: str
+        _datetime: str
+        activity_name: str
+        activity_type_name: str
+        # Sample types, in order of the Log.Cache.order indices
+        type_list: List[str] = field(default_factory=list)
+        # Key = sample type, value = number of samples
+        length_dict: Dict[str, int] = field(default_factory=dict)
+        # Key = column file name, value = [start, count], in array items (bytes for str columns)
+        array_dict: Dict[str, List[int]] = field(default_factory=dict)
+
+    dir_path: str
+    move_list: List[Archive.Move] = field(default_factory=list)
+    # Key = column file name, value = typecode, "" for str columns
+    typecode_dict: Dict[str, str] = field(default_factory=dict)
+    # Key = column file name, value = mapping of its current content
+    _mmap_dict: Dict[str, mmap.mmap | None] = field(default_factory=dict)
+
+    @classmethod
+    def open(cls, dir_path: str):
+
+        logger = logging.getLogger("Archive::open")
+
+        os.makedirs(dir_path, exist_ok=True)
+        archive = Archive(dir_path)
+
+        file_path = os.path.join(dir_path, Archive.FILE_NAME)
+        if not os.path.isfile(file_path):
+            return archive
+
+        with open(file_path, "r") as archive_file:
+            content = json.load(archive_file)
+
+        if content["byteorder"] != sys.byteorder:
+            logger.error("%s written with %s byte order FAILED", dir_path, content["byteorder"])
+            return None
+
+        archive.typecode_dict = content["typecode_dict"]
+        archive.move_list = [Archive.Move(**move) for move in content["move_list"]]
+
+        return archive
+
+    def save(self):
+        # Column files are written first, the table last, so that it never refers to missing data
+        file_path = os.path.join(self.dir_path, Archive.FILE_NAME)
+        tmp_file_path = f"{file_path}.tmp"
+        with open(tmp_file_path, "w") as archive_file:
+            json.dump({
+                "byteorder": sys.byteorder,
+                "typecode_dict": self.typecode_dict,
+                "move_list": [asdict(move) for move in self.move_list],
+            }, archive_file, indent=1)
+        os.replace(tmp_file_path, file_path)
+
+    def close(self):
+        """Drop mappings, views still in use keep theirs until released"""
+        self._mmap_dict = {}
+
+    def find_move(self, log_file_path: str):
+        """Index of the move of a log, None if not in archive"""
+        log_file_path = os.path.abspath(log_file_path)
+        return next((index for index, move in enumerate(self.move_list)
+            if move.log_file_path == log_file_path), None)
+
+    def add(self, log_file_path: str):
+        """Add a log, unless already in archive and unchanged, return its move index, None on error
+
+        save() must be called for added moves to be kept
+        """
+
+        logger = logging.getLogger("Archive::add")
+
+        stat = os.stat(log_file_path)
+        move_index = self.find_move(log_file_path)
+        if move_index is not None:
+            move = self.move_list[move_index]
+            if move.size == stat.st_size and (move.mtime_ns == stat.st_mtime_ns
+                    or move.sha256 == file_sha256(log_file_path)):
+                logger.debug("%s up to date", log_file_path)
+                move.mtime_ns = stat.st_mtime_ns
+                return move_index
+
+        sha256 = file_sha256(log_file_path)
+
+        log = Log.from_file(log_file_path, streaming=True)
+        if not log:
+            logger.error("Get Log.from_file %s FAILED", log_file_path)
+            return None
+
+        log_cache = Log.Cache.from_log(log)
+
+        move = Archive.Move(os.path.abspath(log_file_path), stat.st_size, stat.st_mtime_ns, sha256,
+            log._datetime.strftime(Log.DATETIME_FMT), log.activity_name, log.activity_type_name,
+            list(log_cache.columns_dict))
+
+        self.append_array(move, "order", log_cache.order)
+        for columns in log_cache.columns_dict.values():
+            move.length_dict[columns.type] = columns.length
+            for kind, array_dict in [("data", columns.data), ("mask", columns.mask), ("offsets", columns.offsets)]:
+                for name, data in array_dict.items():
+                    self.append_array(move, f"{columns.type}.{name}.{kind}", data)
+
+        if move_index is not None:
+            # Changed, previous data is left unused
+            del self.move_list[move_index]
+        self.move_list += [move]
+
+        return len(self.move_list) - 1
+
+    def append_array(self, move: Archive.Move, file_name: str, data: array | List[str | None]):
+
+        typecode = data.typecode if isinstance(data, array) else ""
+        if self.typecode_dict.setdefault(file_name, typecode) != typecode:
+            raise ValueError(f"{file_name} typecode {typecode} != {self.typecode_dict[file_name]}")
+
+        file_path = os.path.join(self.dir_path, file_name)
+        with open(file_path, "ab") as column_file:
+            start = column_file.tell()
+            if typecode:
+                data.tofile(column_file)
+                move.array_dict[file_name] = [start // data.itemsize, len(data)]
+            else:
+                content = json.dumps(data).encode()
+                column_file.write(content)
+                move.array_dict[file_name] = [start, len(content)]
+
+        # Mapping is of the previous size
+        self._mmap_dict.pop(file_name, None)
+
+    def get_mmap(self, file_name: str):
+        """Mapping of a column file, None if empty"""
+
+        if file_name not in self._mmap_dict:
+            column_mmap = None
+            with open(os.path.join(self.dir_path, file_name), "rb") as column_file:
+                if os.fstat(column_file.fileno()).st_size > 0:
+                    column_mmap = mmap.mmap(column_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mmap_dict[file_name] = column_mmap
+
+        return self._mmap_dict[file_name]
+
+    def view(self, file_name: str, start: int = 0, count: int | None = None):
+        """View of count items of a column file from start, without copy
+
+        By default, of the arrays of all moves from start: data left unused
+        by changed logs is skipped, which needs a copy if it is in the way.
+        str columns are decoded, so copied
+        """
+
+        typecode = self.typecode_dict[file_name]
+        column_mmap = self.get_mmap(file_name)
+
+        if count is None:
+            # Arrays of moves from start, in file order
+            range_list = sorted((max(range_start, start), range_start + range_count - max(range_start, start))
+                for range_start, range_count in (move.array_dict[file_name] for move in self.move_list
+                    if file_name in move.array_dict)
+                if range_start + range_count > start)
+            if not typecode:
+                # start is in bytes, only whole JSON lists decode
+                return [value for range_start, range_count in range_list if range_start >= start
+                    for value in self.view(file_name, range_start, range_count)]
+            if any(range_list[index][0] + range_list[index][1] != range_list[index + 1][0]
+                    for index in range(len(range_list) - 1)):
+                data = array(typecode)
+                for range_start, range_count in range_list:
+                    data.frombytes(self.view(file_name, range_start, range_count))
+                return memoryview(data)
+            if range_list:
+                start = range_list[0][0]
+                count = range_list[-1][0] + range_list[-1][1] - start
+            else:
+                count = 0
+
+        if column_mmap is None:
+            return memoryview(array(typecode or "B"))
+
+        if not typecode:
+            return json.loads(column_mmap[start:start + count])
+
+        itemsize = array(typecode).itemsize
+        return memoryview(column_mmap)[start * itemsize:(start + count) * itemsize].cast(typecode)
+
+    def move_view(self, move_index: int, file_name: str):
+        """View of the array of a move in a column file, empty if the move has none"""
+
+        start_count = self.move_list[move_index].array_dict.get(file_name)
+        if start_count is None:
+            return memoryview(array(self.typecode_dict.get(file_name) or "B"))
+        return self.view(file_name, *start_count)
+
+    def get_columns(self, move_index: int, type: str):
+        """Log.Columns of a sample type of a move, arrays being views of the column files"""
+
+        sample_cls = next(sample_cls for sample_cls in Log.SAMPLE_CLASS_DICT.values() if sample_cls.type == type)
+        columns = Log.Columns.for_sample_class(sample_cls)
+        columns.length = self.move_list[move_index].length_dict.get(type, 0)
+        for kind, array_dict in [("data", columns.data), ("mask", columns.mask), ("offsets", columns.offsets)]:
+            for name in array_dict:
+                array_dict[name] = self.move_view(move_index, f"{type}.{name}.{kind}")
+        return columns
+
+    def get_log_cache(self, move_index: int):
+        """Move as Log.Cache, e.g. to get its samples back"""
+
+        move = self.move_list[move_index]
+        log = Log(datetime.strptime(move._datetime, Log.DATETIME_FMT), move.activity_name, move.activity_type_name)
+        columns_dict = {type: self.get_columns(move_index, type) for type in move.type_list}
+        return Log.Cache(log, columns_dict, self.move_view(move_index, "order"))
+
+def main():
+    parser = ArgumentParser(prog="archive", description="Archive of decoded Ambit logs")
+    parser.add_argument("archive_dir", help="Path to archive dir")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    add_parser = subparsers.add_parser("add", help="Add logs, or log dirs, not already in archive")
+    add_parser.add_argument("log_path_list", nargs="+", metavar="LOG_PATH")
+    subparsers.add_parser("list", help="List moves")
+    scan_parser = subparsers.add_parser("scan", help="Min, max and mean of a field, per move")
+    scan_parser.add_argument("type", help="Sample type, e.g. periodic")
+    scan_parser.add_argument("field", help="Field, e.g. hr")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    log_level = LOG_LEVEL_DEFAULT
+    if args.verbose:
+        log_level = LOG_LEVEL_VERBOSE
+    logging.basicConfig(format=LOG_FMT, level=log_level)
+
+    logger = logging.getLogger("main")
+
+    archive = Archive.open(args.archive_dir)
+    if not archive:
+        sys.exit(1)
+
+    if args.command == "add":
+        log_file_path_list = []
+        for log_path in args.log_path_list:
+            if os.path.isdir(log_path):
+                log_file_path_list += sorted(glob.glob(os.path.join(log_path, "*.log")))
+            else:
+                log_file_path_list += [log_path]
+        failed_count = 0
+        try:
+            for log_file_path in log_file_path_list:
+                if archive.add(log_file_path) is None:
+                    failed_count += 1
+        finally:
+            archive.save()
+        logger.info("%d moves in archive, %d logs FAILED", len(archive.move_list), failed_count)
+
+    elif args.command == "list":
+        for move in archive.move_list:
+            print(f"{move._datetime} {move.activity_type_name:>16} {move.activity_name:>24} "
+                f"{sum(move.length_dict.values()):8d} samples {move.log_file_path}")
+
+    elif args.command == "scan":
+        sample_cls = next((sample_cls for sample_cls in Log.SAMPLE_CLASS_DICT.values()
+            if sample_cls.type == args.type), None)
+        if not sample_cls or args.field not in [spec.name for spec in Log.Columns.get_spec_list(sample_cls)]:
+            logger.error("Get %s field %s FAILED", args.type, args.field)
+            sys.exit(1)
+        for move_index, move in enumerate(archive.move_list):
+            values = [value for value in archive.get_columns(move_index, args.type).values(args.field)
+                if value is not None]
+            if values and not isinstance(values[0], str):
+                print(f"{move._datetime} {len(values):8d} values, min {min(values)}, max {max(values)}, "
+                    f"mean {sum(values) / len(values):.1f} {move.log_file_path}")
+
+    archive.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,558 @@
+#!/usr/bin/python
+
+""" Benchmarks of the log decoding and conversion tools.
+usage: ./benchmark.py [-r REPEAT] [-l LOG_PATH] benchmark [benchmark ...]
+"""
+
+from argparse import ArgumentParser
+import bisect
+import contextlib
+import copy
+from datetime import datetime, timedelta
+import itertools
+import os
+import shutil
+import tempfile
+import timeit
+import tracemalloc
+import xml.etree.ElementTree as etree
+
+from archive import Archive
+from hr import HeartRate
+from log import Log
+from filehash import file_sha256
+from track import Track
+import openambit2gpx
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "test-data")
+LOG_PATH_DEFAULT = os.path.join(TEST_DATA_DIR, "181two.log")
+
+REPEAT_DEFAULT = 5
+
+def report_time(name: str, func, count: int, repeat: int, unit: str = "sample"):
+    """Print best time out of repeat runs of func, total and per item"""
+    timer = timeit.Timer(func)
+    # Loops per run, for each run to last at least 0.2 s
+    number, _ = timer.autorange()
+    seconds = min(timer.repeat(repeat=repeat, number=number)) / number
+    print(f"{name:>32}: {seconds * 1000:9.2f} ms, {seconds * 1000000 / max(count, 1):8.2f} us/{unit}")
+    return seconds
+
+def quiet(func):
+    """Wrap func so that its prints do not clutter the report"""
+    def quiet_func():
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            return func()
+    return quiet_func
+
+def bench_gpx_fields(log_path: str, repeat: int):
+    """Sample field extraction of openambit2gpx: findtext() per field vs single pass
+
+    Samples of test-data/181two.log have few children, the gain is small:
+    about 1.0-1.2x (median of runs), within run to run noise (0.9-1.6x).
+    """
+
+    sample_elements = etree.parse(log_path).findall("Log/Samples/Sample")
+    print(f"{len(sample_elements)} samples")
+
+    def findtext():
+        # Previous openambit2gpx loop: findtext() for the check, then for the value
+        for element in sample_elements:
+            sampType = element.findtext("Type")
+            lat = element.findtext("Latitude")
+            lon = element.findtext("Longitude")
+            time = element.findtext("UTC")
+            altitude = element.findtext("Altitude") if element.findtext("Altitude") != None else None
+            hr = element.findtext("HR") if element.findtext("HR") != None else None
+            cadence = element.findtext("Cadence") if element.findtext("Cadence") != None else None
+            power = element.findtext("BikePower") if element.findtext("BikePower") != None else None
+            speed = element.findtext("Speed") if element.findtext("Speed") != None else None
+            temp = element.findtext("Temperature") if element.findtext("Temperature") != None else None
+            airpressure = element.findtext("SeaLevelPressure") if element.findtext("SeaLevelPressure") != None else None
+
+    def sample_fields():
+        for element in sample_elements:
+            fields = openambit2gpx.sampleFields(element)
+            sampType = fields.get("Type")
+            lat = fields.get("Latitude")
+            lon = fields.get("Longitude")
+            time = fields.get("UTC")
+            altitude = fields.get("Altitude")
+            hr = fields.get("HR")
+            cadence = fields.get("Cadence")
+            power = fields.get("BikePower")
+            speed = fields.get("Speed")
+            temp = fields.get("Temperature")
+            airpressure = fields.get("SeaLevelPressure")
+
+    before = report_time("findtext", findtext, len(sample_elements), repeat)
+    after = report_time("sampleFields", sample_fields, len(sample_elements), repeat)
+    print(f"{'speedup':>32}: {before / after:9.2f}x")
+
+def bench_gpx_writer(log_path: str, repeat: int):
+    """GPX trkpt writers of openambit2gpx: writing the trkpts of the log, and whole conversion"""
+
+    sample_count = len(etree.parse(log_path).findall("Log/Samples/Sample"))
+
+    # Arguments of each writeTrkpt() of a conversion
+    trkpt_list = []
+    class RecordWriter():
+        def __init__(self, fOut):
+            pass
+        def writeTrkpt(self, *args):
+            trkpt_list.append(args)
+        def flush(self):
+            pass
+    openambit2gpx.GPX_WRITERS["record"] = RecordWriter
+    try:
+        openambit2gpx.convert_log_to_gpx(log_path, os.devnull, writer="record")
+    finally:
+        del openambit2gpx.GPX_WRITERS["record"]
+    print(f"{sample_count} samples, {len(trkpt_list)} trkpts")
+
+    def write_trkpts(writer):
+        def write_trkpts_func():
+            with open(os.devnull, "w") as out_file:
+                trkpt_writer = openambit2gpx.GPX_WRITERS[writer](out_file)
+                for trkpt in trkpt_list:
+                    trkpt_writer.writeTrkpt(*trkpt)
+                trkpt_writer.flush()
+        return write_trkpts_func
+
+    seconds = {}
+    for writer in openambit2gpx.GPX_WRITERS:
+        seconds[writer] = report_time(f"{writer} writeTrkpt", write_trkpts(writer), len(trkpt_list), repeat, "trkpt")
+    print(f"{'speedup':>32}: {seconds['etree'] / seconds['text']:9.2f}x")
+
+    for writer in openambit2gpx.GPX_WRITERS:
+        seconds[writer] = report_time(f"convert_log_to_gpx({writer})",
+            quiet(lambda: openambit2gpx.convert_log_to_gpx(log_path, os.devnull, writer=writer)),
+            sample_count, repeat)
+    print(f"{'speedup':>32}: {seconds['etree'] / seconds['text']:9.2f}x")
+
+def bench_utc(log_path: str, repeat: int):
+    """Sample UTC decoding: strptime() (ms dropped) vs Log.utc_from_str()"""
+
+    utc_str_list = [element.text for element in etree.parse(log_path).iter()
+        if element.tag in ["UTC", "UTCReference"] and element.text]
+    print(f"{len(utc_str_list)} UTC")
+
+    def strptime():
+        for utc_str in utc_str_list:
+            datetime.strptime(utc_str[:-len(".000Z")], Log.DATETIME_FMT)
+
+    def utc_from_str():
+        for utc_str in utc_str_list:
+            Log.utc_from_str(utc_str)
+
+    before = report_time("strptime", strptime, len(utc_str_list), repeat, "UTC")
+    after = report_time("Log.utc_from_str", utc_from_str, len(utc_str_list), repeat, "UTC")
+    print(f"{'speedup':>32}: {before / after:9.2f}x")
+
+def make_gps_log(log_path: str, gps_log_path: str, gps_every: int):
+    """Copy of a log with a gps-base sample (the first of the log) after every gps_every samples, as when GPS is on"""
+
+    tree = etree.parse(log_path)
+    samples_element = tree.find("Log/Samples")
+
+    sample_element_list = list(samples_element)
+    gps_base_element = next((sample_element for sample_element in sample_element_list
+        if sample_element.findtext("Type") == Log.GpsBaseSample.type), None)
+    if gps_base_element is None:
+        shutil.copyfile(log_path, gps_log_path)
+        return
+
+    samples_element[:] = []
+    for index, sample_element in enumerate(sample_element_list):
+        samples_element.append(sample_element)
+        time = sample_element.findtext("Time")
+        if index % gps_every == gps_every - 1 and time:
+            gps_element = copy.deepcopy(gps_base_element)
+            gps_element.find("Time").text = time
+            samples_element.append(gps_element)
+
+    tree.write(gps_log_path, encoding="UTF-8", xml_declaration=True)
+
+def bench_projection(log_path: str, repeat: int):
+    """Parsing and decoding for openambit2gpx, all samples vs GPX_PROJECTION, of the log and a GPS-heavy copy"""
+
+    def iterparse(log_path, projection):
+        def iterparse_func():
+            element_iter = Log.iterparse(log_path, projection)
+            next(element_iter, None)
+            for sample in Log.samples_from_xml(element_iter):
+                pass
+        return iterparse_func
+
+    def peak(func):
+        tracemalloc.start()
+        try:
+            func()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def compare(log_path):
+        element_count = 0
+        gps_base_count = 0
+        for element in Log.iterparse(log_path):
+            element_count += 1
+            gps_base_count += element.findtext("Type") == Log.GpsBaseSample.type
+        # Satellites of gps-base samples are most of what GPX_PROJECTION does not parse
+        print(f"{os.path.basename(log_path)}: {element_count} elements, {gps_base_count} gps-base samples")
+
+        before = report_time("all samples", iterparse(log_path, None), element_count, repeat, "element")
+        after = report_time("GPX_PROJECTION", iterparse(log_path, openambit2gpx.GPX_PROJECTION),
+            element_count, repeat, "element")
+        print(f"{'speedup':>32}: {before / after:9.2f}x")
+        for name, projection in [("all samples", None), ("GPX_PROJECTION", openambit2gpx.GPX_PROJECTION)]:
+            print(f"{name + ' peak':>32}: {peak(iterparse(log_path, projection)) / 1000:9.1f} kB")
+
+    compare(log_path)
+
+    with tempfile.TemporaryDirectory() as dir_path:
+        gps_log_path = os.path.join(dir_path, "gps.log")
+        make_gps_log(log_path, gps_log_path, 2)
+        compare(gps_log_path)
+
+def bench_cache(log_path: str, repeat: int):
+    """Log decoding: XML parsing vs loading Log.Cache"""
+
+    with tempfile.TemporaryDirectory() as dir_path:
+
+        # Not to write the cache next to the log
+        cache_log_path = os.path.join(dir_path, os.path.basename(log_path))
+        shutil.copy(log_path, cache_log_path)
+
+        log = Log(Log.EPOCH, "", "", Log.iter_samples(cache_log_path))
+        Log.Cache.from_log(log).save(cache_log_path, os.stat(cache_log_path), file_sha256(cache_log_path))
+
+        sample_count = len(Log.Cache.load(cache_log_path).order)
+        print(f"{sample_count} samples, {os.path.getsize(cache_log_path) / 1000000:.2f} MB log, "
+            f"{os.path.getsize(Log.Cache.get_file_path(cache_log_path)) / 1000000:.2f} MB cache")
+
+        before = report_time("Log.iter_samples",
+            lambda: sum(1 for _ in Log.iter_samples(cache_log_path)), sample_count, repeat)
+        columns = report_time("Log.Cache.load",
+            lambda: Log.Cache.load(cache_log_path), sample_count, repeat)
+        samples = report_time("Log.Cache.load + iter_samples",
+            lambda: sum(1 for _ in Log.Cache.load(cache_log_path).iter_samples()), sample_count, repeat)
+        print(f"{'speedup (columns)':>32}: {before / columns:9.2f}x")
+        print(f"{'speedup (samples)':>32}: {before / samples:9.2f}x")
+
+def bench_archive(log_path: str, repeat: int):
+    """Temperature scan across moves: decoding each log vs Archive views
+
+    Temperature rather than HR, which the periodic samples of test-data logs do not carry
+    """
+
+    move_count = 20
+    field_name = "temperature"
+
+    with tempfile.TemporaryDirectory() as dir_path:
+
+        log_file_path_list = []
+        for index in range(move_count):
+            log_file_path_list += [os.path.join(dir_path, f"{index}.log")]
+            shutil.copy(log_path, log_file_path_list[-1])
+
+        archive = Archive.open(os.path.join(dir_path, "archive"))
+        for log_file_path in log_file_path_list:
+            assert archive.add(log_file_path) is not None, f"Add {log_path} to archive FAILED"
+        # A changed log added again leaves unused data in the column files, which views skip
+        with open(log_file_path_list[0], "a") as log_file:
+            log_file.write("\n")
+        assert archive.add(log_file_path_list[0]) is not None
+
+        sample_count = sum(len(archive.move_view(index, "order")) for index in range(move_count))
+        value_count = sum(archive.view(f"periodic.{field_name}.mask"))
+        print(f"{move_count} moves, {sample_count} samples, {value_count} {field_name} values")
+        assert value_count, f"No periodic {field_name} in {log_path}, nothing to scan"
+
+        def decode():
+            return sum(getattr(sample, field_name) for log_file_path in log_file_path_list
+                for sample in Log.iter_samples(log_file_path)
+                if isinstance(sample, Log.PeriodicSample) and getattr(sample, field_name) is not None)
+
+        def move_views():
+            return sum(sum(value for value in archive.get_columns(index, "periodic").values(field_name) if value is not None)
+                for index in range(move_count))
+
+        def field_view():
+            return sum(itertools.compress(archive.view(f"periodic.{field_name}.data"),
+                archive.view(f"periodic.{field_name}.mask")))
+
+        assert decode() == move_views() == field_view()
+
+        before = report_time("Log.iter_samples", decode, sample_count, repeat)
+        columns = report_time("Archive.get_columns", move_views, sample_count, repeat)
+        view = report_time("Archive.view", field_view, sample_count, repeat)
+        print(f"{'speedup (get_columns)':>32}: {before / columns:9.2f}x")
+        print(f"{'speedup (view)':>32}: {before / view:9.2f}x")
+
+        archive.close()
+
+def make_ibi_log(log_path: str, ibi_log_path: str, ibi_every: int):
+    """Copy of a log with an ibi sample of 3 heart beats after every ibi_every samples, as with a HR belt"""
+
+    tree = etree.parse(log_path)
+    samples_element = tree.find("Log/Samples")
+
+    sample_element_list = list(samples_element)
+    samples_element[:] = []
+    for index, sample_element in enumerate(sample_element_list):
+        samples_element.append(sample_element)
+        time = sample_element.findtext("Time")
+        if index % ibi_every == ibi_every - 1 and time:
+            # 120 to 50 bpm
+            ibi_list = [500 + (index * 7 + beat * 13) % 700 for beat in range(3)]
+            ibi_element = etree.fromstring(f"""<Sample><Type id="{Log.IbiSample.type_id}">ibi</Type>
+                <UTC></UTC><Time>{time}</Time>{"".join(f"<IBI>{ibi}</IBI>" for ibi in ibi_list)}</Sample>""")
+            samples_element.append(ibi_element)
+
+    tree.write(ibi_log_path, encoding="UTF-8", xml_declaration=True)
+
+def bench_ibi(log_path: str, repeat: int):
+    """HR of an IBI-heavy copy of the log, as in openambit2gpx: previous per-sample ibiToHr queue vs HeartRate.sample_hr per IBI sample"""
+
+    with tempfile.TemporaryDirectory() as dir_path:
+        ibi_log_path = os.path.join(dir_path, "ibi.log")
+        make_ibi_log(log_path, ibi_log_path, 2)
+        sample_elements = etree.parse(ibi_log_path).findall("Log/Samples/Sample")
+
+    element_fields_list = [(element, openambit2gpx.gpxFields(element)) for element in sample_elements]
+    ibi_count = sum(1 for _, fields in element_fields_list if fields.get("Type") == "ibi")
+    print(f"{len(sample_elements)} samples, {ibi_count} IBI samples")
+    assert ibi_count, f"No IBI samples in a copy of {log_path}"
+
+    def ibi_to_hr(average):
+        # Previous openambit2gpx ibiToHr: IBI list parsed again, then one beat popped per sample
+        ibitime_last = None
+        hr_last = 0
+        hrlist = []
+        for element, fields in element_fields_list:
+            if fields.get("Type") == "ibi":
+                ibitime = fields.get("Time")
+                if ibitime_last != ibitime:
+                    hrlist = [int(ibi.text) for ibi in element.findall("IBI")]
+                    if average:
+                        hrlist = [sum(hrlist) / len(hrlist)]
+                ibitime_last = ibitime
+            if len(hrlist) > 0:
+                hr = 60. / (hrlist[0] / 1000.)
+                del hrlist[0]
+            else:
+                hr = hr_last
+            if hr > HeartRate.HR_MAX or hr < HeartRate.HR_MIN:
+                hr = hr_last
+            hr_last = hr
+
+    def sample_hr(average):
+        for _, fields in element_fields_list:
+            if fields.get("Type") == "ibi":
+                HeartRate.sample_hr(fields["IBI"], average)
+
+    for average in [False, True]:
+        before = report_time(f"ibiToHr (average={average})", lambda: ibi_to_hr(average), len(sample_elements), repeat)
+        after = report_time(f"sample_hr (average={average})", lambda: sample_hr(average), len(sample_elements), repeat)
+        print(f"{'speedup':>32}: {before / after:9.2f}x")
+
+def bench_align(log_path: str, repeat: int):
+    """Sensor values of GPX trkpts: channels held in full and bisected per trkpt vs Alignment.rows streamed"""
+
+    def fields_iter():
+        return (openambit2gpx.gpxFields(element) for element in Log.iterparse(log_path, openambit2gpx.GPX_PROJECTION)
+            if element.tag != "Header")
+
+    def bisect_rows():
+        # (sample index, value) of each channel, and targets, of the whole log
+        alignment = openambit2gpx.gpxAlignment()
+        point_lists_dict = {name: ([], []) for name in alignment.channel_dict}
+        target_list = []
+        for index, fields in enumerate(fields_iter()):
+            kind = alignment.kind(fields)
+            for name, channel in alignment.channel_dict.items():
+                value = channel.get(fields) if channel.kinds is None or kind in channel.kinds else None
+                if value is not None:
+                    point_lists_dict[name][0].append(index)
+                    point_lists_dict[name][1].append(value)
+            if alignment.is_target(fields):
+                target_list.append((index, fields))
+
+        for index, fields in target_list:
+            values = {}
+            for name, (index_list, value_list) in point_lists_dict.items():
+                position = bisect.bisect_right(index_list, index)
+                values[name] = value_list[position - 1] if position else None
+            yield fields, values
+
+    def stream_rows():
+        return openambit2gpx.gpxAlignment().rows(fields_iter())
+
+    def consume(rows_func):
+        def consume_func():
+            for _ in rows_func():
+                pass
+        return consume_func
+
+    def peak(func):
+        tracemalloc.start()
+        try:
+            func()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    row_list = list(stream_rows())
+    sample_count = sum(1 for _ in fields_iter())
+    print(f"{sample_count} samples, {len(row_list)} targets, {len(openambit2gpx.gpxAlignment().channel_dict)} channels")
+    assert list(bisect_rows()) == row_list
+    del row_list
+
+    before = report_time("bisect", consume(bisect_rows), sample_count, repeat)
+    after = report_time("Alignment.rows", consume(stream_rows), sample_count, repeat)
+    print(f"{'speedup':>32}: {before / after:9.2f}x")
+    for name, rows_func in [("bisect", bisect_rows), ("Alignment.rows", stream_rows)]:
+        print(f"{name + ' peak':>32}: {peak(consume(rows_func)) / 1000:9.1f} kB")
+
+def make_lap_log(log_path: str, lap_log_path: str, lap_every: int):
+    """Copy of a log with a Manual lap-info sample after every lap_every samples"""
+
+    tree = etree.parse(log_path)
+    samples_element = tree.find("Log/Samples")
+    lap_datetime = tree.findtext("Log/Header/DateTime") or Log.EPOCH.strftime(Log.DATETIME_FMT)
+
+    sample_element_list = list(samples_element)
+    samples_element[:] = []
+    lap_time = 0
+    for index, sample_element in enumerate(sample_element_list):
+        samples_element.append(sample_element)
+        time = sample_element.findtext("Time")
+        if index % lap_every == lap_every - 1 and time:
+            lap_element = etree.fromstring(f"""<Sample><Type id="{Log.LapInfoSample.type_id}">lap-info</Type>
+                <UTC></UTC><Time>{time}</Time><Lap><Type id="1">Manual</Type><DateTime>{lap_datetime}</DateTime>
+                <Duration>{int(time) - lap_time}</Duration><Distance>0</Distance></Lap></Sample>""")
+            samples_element.append(lap_element)
+            lap_time = int(time)
+
+    tree.write(lap_log_path, encoding="UTF-8", xml_declaration=True)
+
+def bench_laps(log_path: str, repeat: int):
+    """GPX lap end points on a lap-heavy copy of the log: UTC strings split per lat and lon vs Track bisection"""
+
+    with tempfile.TemporaryDirectory() as dir_path:
+
+        lap_log_path = os.path.join(dir_path, "laps.log")
+        make_lap_log(log_path, lap_log_path, 10)
+
+        samples = list(Log.iter_samples(lap_log_path))
+        # Trkpts, as openambit2gpx appends them
+        track = Track()
+        for sample in samples:
+            if (not isinstance(sample, Log.PositionSample) and getattr(sample, "latitude", None) is not None
+                    and getattr(sample, "longitude", None) is not None):
+                track.append(sample.time, sample.latitude, sample.longitude)
+        track.sort()
+        lap_time_list = [sample.time for sample in samples if isinstance(sample, Log.LapInfoSample)]
+        # (lap Time, track point before, track point after) of laps within the track
+        endpoint_list = []
+        for lap_time in lap_time_list:
+            index = track.index(lap_time)
+            if 0 <= index < len(track) - 1:
+                endpoint_list += [(lap_time, (track.time_array[index], *track.point(index)),
+                    (track.time_array[index + 1], *track.point(index + 1)))]
+        print(f"{len(samples)} samples, {len(track)} track points, {len(lap_time_list)} laps, "
+            f"{len(endpoint_list)} interpolated end points")
+        if not endpoint_list:
+            return
+
+        # UTC as in logs, from a start across a month and year boundary
+        start = datetime(2023, 12, 31, 23, 50)
+        def utc_text(time):
+            return (start + timedelta(milliseconds=time)).isoformat(timespec="milliseconds") + "Z"
+        utc_endpoint_list = [(utc_text(lap_time), utc_text(before[0]), utc_text(after[0]), before, after)
+            for lap_time, before, after in endpoint_list]
+
+        def time_diff(utc_time_1, utc_time_2):
+            # Previous openambit2gpx utcSplitConvSeconds and timeDiff, only correct within a month
+            def split_seconds(utc_time):
+                tmp_time = utc_time.split("T")[1].split("Z")[0].split(":")
+                tmp_day = int(utc_time.split("T")[0].split("-")[2])
+                return float(tmp_day) * 24 * 3600 + float(tmp_time[0]) * 3600 + float(tmp_time[1]) * 60 + float(tmp_time[2])
+            secs_1 = split_seconds(utc_time_1)
+            secs_2 = split_seconds(utc_time_2)
+            if int(utc_time_2.split("T")[0].split("-")[2]) == 1:
+                secs_1 -= float(utc_time_2.split("T")[0].split("-")[2]) * 24 * 3600
+            return secs_2 - secs_1
+
+        def utc_split():
+            # Previous openambit2gpx lap section, lat and lon interpolated separately
+            return [(((after[1] - before[1]) / time_diff(t1, t2)) * time_diff(t1, t) + before[1],
+                ((after[2] - before[2]) / time_diff(t1, t2)) * time_diff(t1, t) + before[2])
+                for t, t1, t2, before, after in utc_endpoint_list]
+
+        def track_at():
+            return [track.at(lap_time) for lap_time, _, _ in endpoint_list]
+
+        before = report_time("UTC split", utc_split, len(endpoint_list), repeat, "end point")
+        after = report_time("Track.at", track_at, len(endpoint_list), repeat, "end point")
+        print(f"{'speedup':>32}: {before / after:9.2f}x")
+        report_time("convert_log_to_gpx", quiet(lambda: openambit2gpx.convert_log_to_gpx(lap_log_path, os.devnull)),
+            len(samples), repeat)
+
+def report_memory(name: str, func, unit: str = "sample"):
+    """Print memory still allocated by func once returned (i.e. held by its result), total and per item
+
+    Return the result of func and its item count
+    """
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result, count = func()
+        size = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    print(f"{name:>32}: {size / 1000000:9.2f} MB, {size / max(count, 1):8.1f} B/{unit}")
+    return result, count
+
+def bench_memory(log_path: str, repeat: int):
+    """Memory held by decoded samples: Log.Sample objects vs Log.Columns arrays"""
+
+    def sample_list():
+        sample_list = list(Log.iter_samples(log_path))
+        return sample_list, len(sample_list)
+
+    def columns():
+        columns_dict = Log.samples_to_columns(Log.iter_samples(log_path))
+        return columns_dict, sum(len(columns) for columns in columns_dict.values())
+
+    report_memory("Log.Sample list", sample_list)
+    report_memory("Log.samples_to_columns", columns)
+
+BENCHMARKS = {
+    "align": bench_align,
+    "archive": bench_archive,
+    "cache": bench_cache,
+    "gpx-fields": bench_gpx_fields,
+    "gpx-writer": bench_gpx_writer,
+    "ibi": bench_ibi,
+    "laps": bench_laps,
+    "memory": bench_memory,
+    "projection": bench_projection,
+    "utc": bench_utc,
+}
+
+def main():
+    parser = ArgumentParser(prog="benchmark", description="Benchmark log decoding and conversion")
+    parser.add_argument("benchmarks", nargs="+", choices=list(BENCHMARKS) + ["all"], help="Benchmarks to run")
+    parser.add_argument("-l", "--log", default=LOG_PATH_DEFAULT, help="Path to input log file")
+    parser.add_argument("-r", "--repeat", type=int, default=REPEAT_DEFAULT, help="Number of runs, best one is kept")
+    args = parser.parse_args()
+
+    names = list(BENCHMARKS) if "all" in args.benchmarks else args.benchmarks
+    for name in names:
+        print(f"== {name}: {BENCHMARKS[name].__doc__}")
+        BENCHMARKS[name](args.log, args.repeat)
+
+if __name__ == "__main__":
+    main()
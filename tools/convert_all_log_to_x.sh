@@ -1,6 +1,6 @@
 #!/bin/bash
 
-# Convert all logs in given directory to gpx or tcx, if not already existing
+# Convert all logs in given directory to gpx or tcx, if changed since last converted
 
 SCRIPT_DIR="$(dirname "$(readlink -f "$0")")"
 echo "SCRIPT_DIR = $SCRIPT_DIR"
@@ -17,14 +17,6 @@ if [ "$OUT_DIR" = "" ]; then
 fi
 echo "OUT_DIR = $OUT_DIR"
 
-log_list=`ls $LOG_DIR/*.log`
-for log in $log_list ; do
-    echo "log = $log"
-
-    if [[ -f "${log/.log/.gpx}" || -f "${log/.log/.tcx}" ]]; then
-        echo "gpx or tcx file already exists, skipping"
-    else
-        echo $SCRIPT_DIR/openambit2x.py "$log" --out "$OUT_DIR"
-        $SCRIPT_DIR/openambit2x.py "$log" --out "$OUT_DIR"
-    fi
-done
+# Conversions run in parallel, in a single openambit2x process
+echo $SCRIPT_DIR/openambit2x.py --all "$LOG_DIR" --out "$OUT_DIR"
+$SCRIPT_DIR/openambit2x.py --all "$LOG_DIR" --out "$OUT_DIR"
@@ -0,0 +1,9 @@
+
+import hashlib
+
+def file_sha256(file_path: str):
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as _file:
+        for chunk in iter(lambda: _file.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
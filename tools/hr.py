@@ -0,0 +1,26 @@
+from __future__ import annotations
+
+from typing import List
+
+class HeartRate():
+    """Heart rate from IBI samples, one sample at a time, as samples stream through a conversion
+
+    Each IBI sample holds the intervals (ms) of the beats up to its Time.
+    HR out of [HR_MIN, HR_MAX] are sensor errors, dropped, so that the
+    previous valid HR is kept instead.
+    """
+
+    # bpm
+    HR_MIN = 40
+    HR_MAX = 220
+
+    @staticmethod
+    def sample_hr(ibi_list: List[int], average: bool = True):
+        """HR of an IBI sample on its own, at its Time: the average over its beats, or else the one of its
+        last valid beat, None if not valid, e.g. to keep the previous one"""
+        if average:
+            ibi_sum = sum(ibi_list)
+            hr_iter = [60000 * len(ibi_list) / ibi_sum] if ibi_sum else []
+        else:
+            hr_iter = (60000 / ibi for ibi in reversed(ibi_list) if ibi)
+        return next((hr for hr in hr_iter if HeartRate.HR_MIN <= hr <= HeartRate.HR_MAX), None)
@@ -1,13 +1,24 @@
 
 from __future__ import annotations
 
-from dataclasses import dataclass, field
-from datetime import datetime
+from array import array
+from dataclasses import MISSING, dataclass, field, fields, is_dataclass
+from datetime import datetime, timedelta
+import hashlib
+import itertools
+import json
 import logging
+import os
+import re
+import struct
+import sys
 import textwrap
-from typing import List
+import typing
+from typing import ClassVar, Collection, Dict, Iterable, List, Tuple
 import xml.etree.ElementTree as etree
 
+from filehash import file_sha256
+
 @dataclass
 class Log():
 
@@ -15,34 +26,152 @@ class Log():
     # 2024-04-10T06:22:49
     DATETIME_FMT = "%Y-%m-%dT%H:%M:%S"
 
-    @dataclass
+    # Sample UTC format
+    # 2024-04-10T04:22:47.905Z
+    UTC_LEN = len("2024-04-10T04:22:47.905Z")
+
+    # Origin of datetimes stored as ms in Log.Columns
+    EPOCH = datetime(1970, 1, 1)
+
+    @staticmethod
+    def utc_from_str(utc_str: str):
+        """Decode a sample UTC, keeping ms
+
+        Decoded for most samples, fromisoformat() is about 15x faster than strptime() (benchmark.py utc)
+        """
+        if len(utc_str) != Log.UTC_LEN or utc_str[-1] != "Z":
+            raise ValueError(f"Invalid UTC '{utc_str}'")
+        return datetime.fromisoformat(utc_str[:-1])
+
+    # Samples are slotted: no per instance dict, they are many
+    @dataclass(slots=True)
     class Sample():
-        type: str
+        """Base of sample classes, which are decoded from the children tags listed in TAGS
+
+        Classes are looked up in Log.SAMPLE_CLASS_DICT by the Type id attribute.
+        A field without default is required, the sample is dropped if its tag is missing.
+        """
+
+        # Set by each sample class, not stored per instance
+        type: ClassVar[str] = ""
+        # Sample/Type id attribute (libambit ambit_log_sample_type_t)
+        type_id: ClassVar[int] = 0
+        # Key = field name, value = tag
+        TAGS: ClassVar[Dict[str, str]] = {}
+        # Key = sample class, value = (name, tag, decode function, required, repeated tag) of its TAGS
+        _field_decoder_dict: ClassVar[Dict[typing.Type[Log.Sample], List[Tuple[str, str, typing.Callable, bool, bool]]]] = {}
         time: int
 
+        @staticmethod
+        def text_decoder(parse: typing.Callable):
+            """Decode function of a field from the text of its element, None if empty"""
+            return lambda element: parse(element.text) if element.text else None
+
+        @classmethod
+        def get_field_decoder_list(cls):
+            """Field decoders of a sample class, from its TAGS and field types, computed once
+
+            A decode function gets the element of the field tag, nested dataclasses
+            (LapInfoSample lap) being decoded by their own from_xml()
+            """
+
+            field_decoder_list = Log.Sample._field_decoder_dict.get(cls)
+            if field_decoder_list is not None:
+                return field_decoder_list
+
+            field_decoder_list = []
+            type_hints = typing.get_type_hints(cls, globalns=globals())
+            for _field in fields(cls):
+                tag = cls.TAGS.get(_field.name)
+                if not tag:
+                    continue
+                field_type = type_hints[_field.name]
+                # X | None
+                type_args = [arg for arg in typing.get_args(field_type) if arg is not type(None)]
+                repeated = typing.get_origin(field_type) in [list, List]
+                if type_args:
+                    field_type = type_args[0]
+                required = _field.default is MISSING and _field.default_factory is MISSING
+                if is_dataclass(field_type):
+                    decode = field_type.from_xml
+                elif field_type is datetime:
+                    decode = Log.Sample.text_decoder(Log.utc_from_str)
+                else:
+                    decode = Log.Sample.text_decoder(field_type)
+                field_decoder_list += [(_field.name, tag, decode, required, repeated)]
+
+            Log.Sample._field_decoder_dict[cls] = field_decoder_list
+            return field_decoder_list
+
         @classmethod
         def from_xml(cls, sample: etree.Element):
+            """Decode a Sample element, as the sample class of its Type id if called on Log.Sample"""
 
             logger = logging.getLogger("Log.Sample::from_xml")
 
-            type = sample.findtext("Type")
-            if not type:
-                logger.error("Get Type FAILED")
-                return None
+            if cls is Log.Sample:
+                type_element = sample.find("Type")
+                if type_element is None:
+                    logger.error("Get Type FAILED")
+                    return None
 
-            if type == Log.PeriodicSample.type:
-                return Log.PeriodicSample.from_xml(sample)
-            if type == Log.GpsSmallSample.type:
-                return Log.GpsSmallSample.from_xml(sample)
-            if type == Log.LapInfoSample.type:
-                return Log.LapInfoSample.from_xml(sample)
-            else:
-                logger.debug("Unhandled type %s", type)
+                type_id_str = type_element.get("id")
+                if not type_id_str or not type_id_str.isdigit():
+                    logger.error("Get Type id FAILED")
+                    return None
+
+                sample_cls = Log.SAMPLE_CLASS_DICT.get(int(type_id_str))
+                if not sample_cls:
+                    logger.debug("Unhandled type %s (%s)", type_element.text, type_id_str)
+                    return None
+
+                return sample_cls.from_xml(sample)
+
+            # Single pass over children, first occurrence of a tag wins as with findtext()
+            # (periodic samples repeat Time)
+            child_dict = {child.tag: child for child in reversed(sample)}
+
+            time_element = child_dict.get("Time")
+            if time_element is None or not time_element.text:
+                logger.error("Get %s Time FAILED", cls.type)
                 return None
 
-    @dataclass
+            value_dict = {"time": int(time_element.text)}
+
+            for name, tag, decode, required, repeated in cls.get_field_decoder_list():
+                if repeated:
+                    value_dict[name] = [value for value in map(decode, sample.iterfind(tag)) if value is not None]
+                    continue
+                element = child_dict.get(tag)
+                value = decode(element) if element is not None else None
+                if value is not None:
+                    value_dict[name] = value
+                elif required:
+                    logger.error("Get %s %s FAILED", cls.type, tag)
+                    return None
+
+            return cls(**value_dict)
+
+    @dataclass(slots=True)
     class PeriodicSample(Sample):
         type = "periodic"
+        type_id = 512
+        TAGS = {
+            "utc": "UTC",
+            "cadence": "Cadence",
+            "energy_consumption": "EnergyConsumption",
+            "temperature": "Temperature",
+            "altitude": "Altitude",
+            "distance": "Distance",
+            "speed": "Speed",
+            "hr": "HR",
+            "latitude": "Latitude",
+            "longitude": "Longitude",
+            "vertical_speed": "VerticalSpeed",
+            "abs_pressure": "AbsPressure",
+            "sea_level_pressure": "SeaLevelPressure",
+            "bike_power": "BikePower",
+        }
         utc: datetime | None = None
         cadence: int | None = None
         energy_consumption: int | None = None
@@ -50,115 +179,139 @@ class Log():
         altitude: int | None = None
         distance: int | None = None
         speed: int | None = None
+        hr: int | None = None
+        latitude: int | None = None
+        longitude: int | None = None
+        vertical_speed: int | None = None
+        abs_pressure: int | None = None
+        sea_level_pressure: int | None = None
+        bike_power: int | None = None
+
+    @dataclass(slots=True)
+    class LogPauseSample(Sample):
+        type = "log-pause"
+        type_id = 772
+
+    @dataclass(slots=True)
+    class LogRestartSample(Sample):
+        type = "log-restart"
+        type_id = 773
+
+    @dataclass(slots=True)
+    class IbiSample(Sample):
+        type = "ibi"
+        type_id = 774
+        TAGS = {"utc": "UTC", "ibi_list": "IBI"}
+        # Inter beat intervals, ms
+        ibi_list: List[int] = field(default_factory=list)
+        utc: datetime | None = None
 
-        @classmethod
-        def from_xml(cls, sample: etree.Element):
-
-            logger = logging.getLogger("Log.PeriodicSample::from_xml")
-
-            time_str = sample.findtext("Time")
-            if not time_str:
-                logger.error("Get Time FAILED")
-                return None
-            time = int(time_str)
-
-            utc = None
-            utc_str = sample.findtext("UTC")
-            if utc_str:
-                # UTC format = 2024-04-10T04:22:47.905Z
-                # Strip trailling ms
-                utc = datetime.strptime(utc_str[:-len(".000Z")], Log.DATETIME_FMT)
-
-            cadence = None
-            cadence_str = sample.findtext("Cadence")
-            if cadence_str:
-                cadence = int(cadence_str)
-
-            energy_consumption = None
-            energy_consumption_str = sample.findtext("EnergyConsumption")
-            if energy_consumption_str:
-                energy_consumption = int(energy_consumption_str)
-
-            temperature = None
-            temperature_str = sample.findtext("Temperature")
-            if temperature_str:
-                temperature = int(temperature_str)
-
-            altitude = None
-            altitude_str = sample.findtext("Altitude")
-            if altitude_str:
-                altitude = int(altitude_str)
-
-            distance = None
-            distance_str = sample.findtext("Distance")
-            if distance_str:
-                distance = int(distance_str)
-
-            speed = None
-            speed_str = sample.findtext("Speed")
-            if speed_str:
-                speed = int(speed_str)
-
-            return Log.PeriodicSample(
-                cls.type,
-                time,
-                utc=utc,
-                cadence=cadence,
-                energy_consumption=energy_consumption,
-                temperature=temperature,
-                altitude=altitude,
-                distance=distance,
-                speed=speed)
+    @dataclass(slots=True)
+    class DistanceSourceSample(Sample):
+        type = "distance-source"
+        type_id = 776
+        TAGS = {"utc": "UTC", "distance_source": "DistanceSource"}
+        distance_source: str
+        utc: datetime | None = None
 
-    @dataclass
+    @dataclass(slots=True)
+    class GpsBaseSample(Sample):
+        type = "gps-base"
+        type_id = 783
+        TAGS = {
+            "utc_reference": "UTCReference",
+            "latitude": "Latitude",
+            "longitude": "Longitude",
+            "utc": "UTC",
+            "nav_valid": "NavValid",
+            "nav_type": "NavType",
+            "gps_altitude": "GPSAltitude",
+            "gps_speed": "GPSSpeed",
+            "gps_heading": "GPSHeading",
+            "ehpe": "EHPE",
+            "number_of_satellites": "NumberOfSatellites",
+            "gps_hdop": "GpsHDOP",
+        }
+        utc_reference: datetime
+        latitude: int
+        longitude: int
+        utc: datetime | None = None
+        nav_valid: int | None = None
+        nav_type: int | None = None
+        gps_altitude: int | None = None
+        gps_speed: int | None = None
+        gps_heading: int | None = None
+        ehpe: int | None = None
+        number_of_satellites: int | None = None
+        gps_hdop: int | None = None
+
+    @dataclass(slots=True)
     class GpsSmallSample(Sample):
         type = "gps-small"
+        type_id = 784
+        TAGS = {
+            "utc": "UTC",
+            "latitude": "Latitude",
+            "longitude": "Longitude",
+            "ehpe": "EHPE",
+            "number_of_satellites": "NumberOfSatellites",
+        }
         utc: datetime
         latitude: int
         longitude: int
+        ehpe: int | None = None
+        number_of_satellites: int | None = None
+
+    @dataclass(slots=True)
+    class GpsTinySample(Sample):
+        type = "gps-tiny"
+        type_id = 785
+        TAGS = {"utc": "UTC", "latitude": "Latitude", "longitude": "Longitude", "ehpe": "EHPE"}
+        latitude: int
+        longitude: int
+        utc: datetime | None = None
+        ehpe: int | None = None
+
+    @dataclass(slots=True)
+    class TimeSample(Sample):
+        type = "time"
+        type_id = 786
+        TAGS = {"time_ref": "TimeRef", "utc": "UTC"}
+        # Time of day, hh:mm:ss
+        time_ref: str
+        utc: datetime | None = None
 
-        @classmethod
-        def from_xml(cls, sample: etree.Element):
-
-            logger = logging.getLogger("Log.GpsSmallSample::from_xml")
-
-            time_str = sample.findtext("Time")
-            if not time_str:
-                logger.error("Get Time FAILED")
-                return None
-            time = int(time_str)
-
-            utc_str = sample.findtext("UTC")
-            if not utc_str:
-                logger.error("Get UTC FAILED")
-                return None
-            # UTC format = 2024-04-10T04:22:47.905Z
-            # Strip trailling ms
-            utc = datetime.strptime(utc_str[:-len(".000Z")], Log.DATETIME_FMT)
-
-            latitude_str = sample.findtext("Latitude")
-            if not latitude_str:
-                logger.error("Get Latitude FAILED")
-                return None
-            latitude = int(latitude_str)
+    @dataclass(slots=True)
+    class ActivitySample(Sample):
+        type = "activity"
+        type_id = 792
+        TAGS = {"activity_type": "ActivityType", "custom_mode_id": "CustomModeId", "utc": "UTC"}
+        activity_type: int
+        custom_mode_id: int | None = None
+        utc: datetime | None = None
 
-            longitude_str = sample.findtext("Longitude")
-            if not longitude_str:
-                logger.error("Get Longitude FAILED")
-                return None
-            longitude = int(longitude_str)
+    @dataclass(slots=True)
+    class PositionSample(Sample):
+        type = "position"
+        type_id = 795
+        TAGS = {"latitude": "Latitude", "longitude": "Longitude", "utc": "UTC"}
+        latitude: int
+        longitude: int
+        utc: datetime | None = None
 
-            return Log.GpsSmallSample(
-                cls.type,
-                time,
-                utc,
-                latitude,
-                longitude)
+    @dataclass(slots=True)
+    class FwInfoSample(Sample):
+        type = "fwinfo"
+        type_id = 796
+        TAGS = {"version": "Version", "build_date": "BuildDate", "utc": "UTC"}
+        version: str
+        build_date: str | None = None
+        utc: datetime | None = None
 
-    @dataclass
+    @dataclass(slots=True)
     class LapInfoSample(Sample):
 
-        @dataclass
+        @dataclass(slots=True)
         class Lap():
             type: str
             _datetime: datetime
@@ -200,53 +353,466 @@ class Log():
                 return Log.LapInfoSample.Lap(type, _datetime, duration, distance)
 
         type = "lap-info"
+        type_id = 777
+        TAGS = {"lap": "Lap", "utc": "UTC"}
         lap: Log.LapInfoSample.Lap
         utc: datetime | None = None
 
+    # Key = Sample/Type id attribute, samples of other types are skipped
+    SAMPLE_CLASS_DICT = {sample_cls.type_id: sample_cls for sample_cls in [
+        PeriodicSample,
+        LogPauseSample,
+        LogRestartSample,
+        IbiSample,
+        DistanceSourceSample,
+        LapInfoSample,
+        GpsBaseSample,
+        GpsSmallSample,
+        GpsTinySample,
+        TimeSample,
+        ActivitySample,
+        PositionSample,
+        FwInfoSample,
+    ]}
+
+    @dataclass
+    class Projection():
+        """Sample types kept by Log.iterparse(projection), and the bulky sample subtrees they need
+
+        Samples of other types are dropped before being yielded, and subtrees of
+        SUBTREE_TAGS not needed (gps-base Satellites) are stripped from the raw
+        log, not even parsed. Other children of kept samples are all kept:
+        dropping them one by one costs more than it saves (benchmark.py projection).
+        """
+
+        # Sample subtrees stripped from the raw log before parsing, unless kept
+        SUBTREE_TAGS = ["Satellites"]
+
+        # Sample types kept, None for all
+        types: Collection[str] | None = None
+        # Tags of SUBTREE_TAGS kept
+        subtree_tags: Collection[str] = frozenset()
+
+        def keeps_type(self, type: str):
+            return self.types is None or type in self.types
+
+        def union(self, projection: Log.Projection):
+            """Projection keeping what either this one or projection keeps"""
+            types = None
+            if self.types is not None and projection.types is not None:
+                types = frozenset(self.types) | frozenset(projection.types)
+            return Log.Projection(types, frozenset(self.subtree_tags) | frozenset(projection.subtree_tags))
+
         @classmethod
-        def from_xml(cls, sample: etree.Element):
+        def for_sample_classes(cls, sample_cls_list: Iterable[typing.Type[Log.Sample]]):
+            """Projection on what sample classes decode"""
+            sample_cls_list = list(sample_cls_list)
+            return Log.Projection(frozenset(sample_cls.type for sample_cls in sample_cls_list),
+                frozenset(tag for tag in Log.Projection.SUBTREE_TAGS
+                    if any(tag in sample_cls.TAGS.values() for sample_cls in sample_cls_list)))
+
+        @classmethod
+        def for_decoding(cls):
+            """Projection on what Log.Sample.from_xml() decodes"""
+            return Log.Projection.for_sample_classes(Log.SAMPLE_CLASS_DICT.values())
+
+    @dataclass
+    class Columns():
+        """Samples of one type stored column-wise, an array per field instead of an object per sample
+
+        Nested fields are flattened, e.g. LapInfoSample lap.distance.
+        int fields are stored as "q", datetimes as "q" ms since Log.EPOCH, str in lists.
+        List fields (IbiSample ibi_list) are stored flat, with the end offset of each list.
+        A missing (None) value is stored as 0, with 0 in the mask of the field,
+        masks being only kept for optional fields.
+        """
+
+        # Field type to array typecode, "" for a list
+        TYPECODES = {int: "q", float: "d", datetime: "q", str: ""}
+
+        @dataclass
+        class Spec():
+            name: str
+            # Attributes to get, from sample to value
+            path: Tuple[str, ...]
+            _type: type
+            optional: bool
+            # List of _type
+            repeated: bool = False
+
+        type: str
+        spec_list: List[Log.Columns.Spec]
+        length: int = 0
+        data: Dict[str, array | List[str | None]] = field(default_factory=dict)
+        mask: Dict[str, array] = field(default_factory=dict)
+        # Key = name of a repeated field, value = end of each list in data
+        offsets: Dict[str, array] = field(default_factory=dict)
+
+        @staticmethod
+        def get_spec_list(cls: type, prefix: str = "", path: Tuple[str, ...] = (), optional: bool = False):
+            """Column specs of the fields of a sample class, nested dataclass fields flattened"""
+
+            spec_list: List[Log.Columns.Spec] = []
+
+            type_hints = typing.get_type_hints(cls, globalns=globals())
+            for _field in fields(cls):
+                field_type = type_hints[_field.name]
+                field_optional = optional
+                repeated = typing.get_origin(field_type) in [list, List]
+                # X | None, List[X]
+                type_args = [arg for arg in typing.get_args(field_type) if arg is not type(None)]
+                if type_args:
+                    field_optional = field_optional or not repeated
+                    field_type = type_args[0]
+                if is_dataclass(field_type):
+                    spec_list += Log.Columns.get_spec_list(field_type,
+                        f"{prefix}{_field.name}.", path + (_field.name,), field_optional)
+                elif field_type in Log.Columns.TYPECODES and not (repeated and field_type in [str, datetime]):
+                    spec_list += [Log.Columns.Spec(
+                        f"{prefix}{_field.name}", path + (_field.name,), field_type, field_optional, repeated)]
+
+            return spec_list
+
+        @classmethod
+        def for_sample_class(cls, sample_cls: type):
+            columns = Log.Columns(sample_cls.type, Log.Columns.get_spec_list(sample_cls))
+            for spec in columns.spec_list:
+                typecode = Log.Columns.TYPECODES[spec._type]
+                columns.data[spec.name] = array(typecode) if typecode else []
+                if spec.optional:
+                    columns.mask[spec.name] = array("B")
+                if spec.repeated:
+                    columns.offsets[spec.name] = array("q")
+            return columns
+
+        def append(self, sample: Log.Sample):
+
+            for spec in self.spec_list:
+
+                value = sample
+                for attr in spec.path:
+                    value = getattr(value, attr) if value is not None else None
+
+                if spec.optional:
+                    self.mask[spec.name].append(value is not None)
+
+                if spec.repeated:
+                    self.data[spec.name].extend(value)
+                    self.offsets[spec.name].append(len(self.data[spec.name]))
+                    continue
+
+                if value is None:
+                    value = None if spec._type is str else 0
+                elif spec._type is datetime:
+                    value = (value - Log.EPOCH) // timedelta(milliseconds=1)
+
+                self.data[spec.name].append(value)
+
+            self.length += 1
+
+        def values(self, name: str):
+            """Yield values of a column, None if missing, datetimes converted back"""
+
+            spec = next(spec for spec in self.spec_list if spec.name == name)
+            data = self.data[name]
+            mask = self.mask.get(name)
+
+            if spec.repeated:
+                start = 0
+                for end in self.offsets[name]:
+                    yield data[start:end].tolist()
+                    start = end
+                return
+
+            for index in range(self.length):
+                if mask is not None and not mask[index]:
+                    yield None
+                elif spec._type is datetime:
+                    yield Log.EPOCH + timedelta(milliseconds=data[index])
+                else:
+                    yield data[index]
+
+        def iter_samples(self):
+            """Yield the samples back as Log.Sample objects"""
+
+            sample_cls = next(sample_cls for sample_cls in Log.SAMPLE_CLASS_DICT.values()
+                if sample_cls.type == self.type)
+
+            value_iter_list = [self.values(spec.name) for spec in self.spec_list]
+
+            if all(len(spec.path) == 1 for spec in self.spec_list):
+                # Specs are in field order
+                yield from itertools.starmap(sample_cls, zip(*value_iter_list))
+                return
+
+            for value_list in zip(*value_iter_list):
+                yield Log.Columns.make(sample_cls,
+                    [(spec.path, value) for spec, value in zip(self.spec_list, value_list)])
+
+        @staticmethod
+        def make(cls: type, path_value_list: List[Tuple[Tuple[str, ...], typing.Any]]):
+            """Build a dataclass instance from (path, value) of its (nested) fields, as in Spec"""
+
+            kwargs = {}
+            # Key = nested dataclass field name, value = (path in it, value) of its fields
+            nested_dict: Dict[str, List[Tuple[Tuple[str, ...], typing.Any]]] = {}
+            for path, value in path_value_list:
+                if len(path) == 1:
+                    kwargs[path[0]] = value
+                else:
+                    nested_dict.setdefault(path[0], []).append((path[1:], value))
+
+            if nested_dict:
+                type_hints = typing.get_type_hints(cls, globalns=globals())
+                for name, nested_path_value_list in nested_dict.items():
+                    nested_cls = next(arg for arg in [type_hints[name], *typing.get_args(type_hints[name])]
+                        if is_dataclass(arg))
+                    if all(value is None for _, value in nested_path_value_list):
+                        kwargs[name] = None
+                    else:
+                        kwargs[name] = Log.Columns.make(nested_cls, nested_path_value_list)
+
+            return cls(**kwargs)
+
+        def __len__(self):
+            return self.length
 
-            logger = logging.getLogger("Log.LapInfoSample::from_xml")
+    @dataclass
+    class Cache():
+        """Decoded log, stored as Log.Columns in a binary sidecar file next to the log file
+
+        Layout: MAGIC, header length (u32), header (JSON), then the arrays of the
+        columns as raw bytes, each aligned on ALIGN bytes so that the file can
+        be memory-mapped as is. The cache is valid as long as the log file has
+        not changed (same size and mtime, or else same content hash) and the
+        cache was written by the same decoder (log.py).
+        """
+
+        SUFFIX = ".cache"
+        MAGIC = b"OALCACHE"
+        ALIGN = 8
+
+        # Header fields only, samples are in columns_dict
+        log: Log
+        columns_dict: Dict[str, Log.Columns]
+        # Index in columns_dict of the type of each sample, in log order
+        order: array = field(default_factory=lambda: array("B"))
+
+        @staticmethod
+        def get_file_path(log_file_path: str):
+            return f"{log_file_path}{Log.Cache.SUFFIX}"
+
+        @staticmethod
+        def decoder_version():
+            """Hash of log.py, which decodes samples and defines columns"""
+            with open(__file__, "rb") as source_file:
+                return hashlib.sha256(source_file.read()).hexdigest()[:16]
+
+        @classmethod
+        def from_log(cls, log: Log):
+            """Cache of a log, iterates log.sample_list"""
+            order = array("B")
+            columns_dict = Log.samples_to_columns(log.sample_list, order)
+            return Log.Cache(Log(log._datetime, log.activity_name, log.activity_type_name), columns_dict, order)
+
+        def iter_samples(self):
+            """Yield the samples back as Log.Sample objects, in log order"""
+            sample_iter_list = [columns.iter_samples() for columns in self.columns_dict.values()]
+            for index in self.order:
+                yield next(sample_iter_list[index])
+
+        def to_log(self):
+            """Log with sample_list as a generator of the cached samples"""
+            return Log(self.log._datetime, self.log.activity_name, self.log.activity_type_name, self.iter_samples())
+
+        def save(self, log_file_path: str, stat: os.stat_result, sha256: str):
+            """Write the cache of log_file_path, which had stat and sha256 when decoded"""
+
+            # Raw bytes of the arrays, after the header
+            block_list: List[bytes] = []
+            offset = 0
+
+            def add_block(data: array | List[str | None]):
+                nonlocal offset
+                block = data.tobytes() if isinstance(data, array) else json.dumps(data).encode()
+                block_dict = {"offset": offset, "size": len(block)}
+                block += bytes(-len(block) % Log.Cache.ALIGN)
+                block_list.append(block)
+                offset += len(block)
+                return block_dict
+
+            header = {
+                "byteorder": sys.byteorder,
+                "decoder": Log.Cache.decoder_version(),
+                "log_file": {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256},
+                "log": {
+                    "datetime": self.log._datetime.strftime(Log.DATETIME_FMT),
+                    "activity_name": self.log.activity_name,
+                    "activity_type_name": self.log.activity_type_name,
+                },
+                "order": add_block(self.order),
+                "columns": [{
+                    "type": columns.type,
+                    "length": columns.length,
+                    "data": {name: add_block(data) for name, data in columns.data.items()},
+                    "mask": {name: add_block(mask) for name, mask in columns.mask.items()},
+                    "offsets": {name: add_block(offsets) for name, offsets in columns.offsets.items()},
+                } for columns in self.columns_dict.values()],
+            }
+            Log.Cache.write(Log.Cache.get_file_path(log_file_path), header, block_list)
+
+        @staticmethod
+        def header_bytes(header: Dict):
+            """Header as JSON, padded with spaces so that blocks are aligned"""
+            header_bytes = json.dumps(header).encode()
+            return header_bytes + b" " * (-(len(Log.Cache.MAGIC) + 4 + len(header_bytes)) % Log.Cache.ALIGN)
+
+        @staticmethod
+        def write(cache_file_path: str, header: Dict, block_list: List[bytes]):
+            """Write a cache file, aside then renamed, not to leave a truncated cache if interrupted"""
+            header_bytes = Log.Cache.header_bytes(header)
+            tmp_file_path = f"{cache_file_path}.tmp"
+            with open(tmp_file_path, "wb") as cache_file:
+                cache_file.write(Log.Cache.MAGIC)
+                cache_file.write(struct.pack("<I", len(header_bytes)))
+                cache_file.write(header_bytes)
+                for block in block_list:
+                    cache_file.write(block)
+            os.replace(tmp_file_path, cache_file_path)
+
+        @classmethod
+        def load(cls, log_file_path: str):
+            """Read the cache of log_file_path, None if there is none, or it is stale or corrupt"""
+
+            logger = logging.getLogger("Log.Cache::load")
 
-            time_str = sample.findtext("Time")
-            if not time_str:
-                logger.error("Get Time FAILED")
+            cache_file_path = Log.Cache.get_file_path(log_file_path)
+            if not os.path.isfile(cache_file_path):
                 return None
-            time = int(time_str)
 
-            utc = None
-            utc_str = sample.findtext("UTC")
-            if utc_str:
-                # UTC format = 2024-04-10T04:22:47.905Z
-                # Strip trailling ms
-                utc = datetime.strptime(utc_str[:-len(".000Z")], Log.DATETIME_FMT)
+            with open(cache_file_path, "rb") as cache_file:
+                content = memoryview(cache_file.read())
 
-            lap_element = sample.find("Lap")
-            if not lap_element:
-                logger.error("Get Lap FAILED")
+            try:
+                return Log.Cache.from_content(log_file_path, cache_file_path, content)
+            except (ValueError, KeyError, IndexError, TypeError, StopIteration, struct.error) as exc:
+                # Truncated or corrupt, e.g. written by hand or by a crashed save
+                logger.warning("%s is corrupt, ignored (%s: %s)", cache_file_path, type(exc).__name__, exc)
                 return None
 
-            lap = Log.LapInfoSample.Lap.from_xml(lap_element)
-            if not lap:
-                logger.error("Log.LapInfoSample.Lap.from_xml FAILED")
+        @staticmethod
+        def from_content(log_file_path: str, cache_file_path: str, content: memoryview):
+            """Cache read from the content of cache_file_path, None if stale, raises if corrupt"""
+
+            logger = logging.getLogger("Log.Cache::load")
+
+            magic_len = len(Log.Cache.MAGIC)
+            if content[:magic_len] != Log.Cache.MAGIC:
+                logger.warning("%s is not a log cache", cache_file_path)
+                return None
+            header_len, = struct.unpack_from("<I", content, magic_len)
+            header_bytes = content[magic_len + 4:magic_len + 4 + header_len]
+            if len(header_bytes) != header_len:
+                raise ValueError("truncated header")
+            header = json.loads(bytes(header_bytes))
+            blocks = content[magic_len + 4 + header_len:]
+
+            if header["byteorder"] != sys.byteorder or header["decoder"] != Log.Cache.decoder_version():
+                logger.debug("%s written by another decoder", cache_file_path)
                 return None
 
-            return Log.LapInfoSample(cls.type, time, lap, utc=utc)
+            stat = os.stat(log_file_path)
+            if header["log_file"]["size"] != stat.st_size:
+                return None
+            if header["log_file"]["mtime_ns"] != stat.st_mtime_ns:
+                # Touched or copied again, only hash tells whether content changed
+                if header["log_file"]["sha256"] != file_sha256(log_file_path):
+                    return None
+                # Unchanged, so that next loads do not hash it again
+                header["log_file"]["mtime_ns"] = stat.st_mtime_ns
+                new_header_bytes = Log.Cache.header_bytes(header)
+                if len(new_header_bytes) <= header_len:
+                    with open(cache_file_path, "r+b") as cache_file:
+                        cache_file.seek(magic_len + 4)
+                        cache_file.write(new_header_bytes.ljust(header_len))
+                else:
+                    Log.Cache.write(cache_file_path, header, [blocks])
+
+            def get_block(block_dict: Dict[str, int], typecode: str):
+                if block_dict["offset"] + block_dict["size"] > len(blocks):
+                    raise ValueError("truncated block")
+                block = blocks[block_dict["offset"]:block_dict["offset"] + block_dict["size"]]
+                if not typecode:
+                    return json.loads(bytes(block))
+                data = array(typecode)
+                data.frombytes(block)
+                return data
+
+            log = Log(
+                datetime.strptime(header["log"]["datetime"], Log.DATETIME_FMT),
+                header["log"]["activity_name"],
+                header["log"]["activity_type_name"])
+
+            order = get_block(header["order"], "B")
+
+            columns_dict: Dict[str, Log.Columns] = {}
+            for columns_header in header["columns"]:
+                sample_cls = next(sample_cls for sample_cls in Log.SAMPLE_CLASS_DICT.values()
+                    if sample_cls.type == columns_header["type"])
+                columns = Log.Columns.for_sample_class(sample_cls)
+                columns.length = columns_header["length"]
+                for spec in columns.spec_list:
+                    typecode = Log.Columns.TYPECODES[spec._type]
+                    columns.data[spec.name] = get_block(columns_header["data"][spec.name], typecode)
+                    if spec.optional:
+                        columns.mask[spec.name] = get_block(columns_header["mask"][spec.name], "B")
+                    if spec.repeated:
+                        columns.offsets[spec.name] = get_block(columns_header["offsets"][spec.name], "q")
+                columns_dict[columns.type] = columns
+
+            return Log.Cache(log, columns_dict, order)
 
     _datetime: datetime
     activity_name: str
     activity_type_name: str
-    sample_list: List[Log.Sample] = field(default_factory=list)
+    # List, or single-use generator if read with from_file(streaming=True)
+    sample_list: Iterable[Log.Sample] = field(default_factory=list)
 
-    @classmethod
-    def from_xml(cls, log_element: etree.Element):
+    def to_columns(self):
+        """Samples as Log.Columns, per sample type
 
-        logger = logging.getLogger("Log::from_xml")
+        Iterates sample_list only once, so with from_file(streaming=True)
+        samples are never all held as objects at once
+        """
+        return Log.samples_to_columns(self.sample_list)
 
-        header = log_element.find("Header")
-        if not header:
-            logger.error("Get Header FAILED")
-            return None
+    @staticmethod
+    def samples_to_columns(samples: Iterable[Log.Sample], order: array | None = None):
+        """Samples as Log.Columns, per sample type
+
+        order, if any, gets the index in the returned dict of the type of each sample
+        """
+
+        columns_dict: Dict[str, Log.Columns] = {}
+        # Key = sample type, value = index in columns_dict
+        index_dict: Dict[str, int] = {}
+
+        for sample in samples:
+            columns = columns_dict.get(sample.type)
+            if columns is None:
+                columns = Log.Columns.for_sample_class(type(sample))
+                index_dict[sample.type] = len(columns_dict)
+                columns_dict[sample.type] = columns
+            columns.append(sample)
+            if order is not None:
+                order.append(index_dict[sample.type])
+
+        return columns_dict
+
+    @classmethod
+    def from_header_xml(cls, header: etree.Element):
+
+        logger = logging.getLogger("Log::from_header_xml")
 
         datetime_str = header.findtext("DateTime")
         if not datetime_str:
@@ -258,14 +824,26 @@ class Log():
             logger.error("Get Header/Activity FAILED")
             return
 
-        activity_type_name = header.findtext("ActivityTypeName")
-        if not activity_type_name:
-            logger.error("Get Header/ActivityTypeName FAILED")
-            return
+        # Missing from some logs, e.g. of older firmwares
+        activity_type_name = header.findtext("ActivityTypeName") or ""
 
         _datetime = datetime.strptime(datetime_str, Log.DATETIME_FMT)
 
-        log = Log(_datetime, activity_name, activity_type_name)
+        return Log(_datetime, activity_name, activity_type_name)
+
+    @classmethod
+    def from_xml(cls, log_element: etree.Element):
+
+        logger = logging.getLogger("Log::from_xml")
+
+        header = log_element.find("Header")
+        if not header:
+            logger.error("Get Header FAILED")
+            return None
+
+        log = Log.from_header_xml(header)
+        if not log:
+            return None
 
         for sample_element in log_element.iterfind("Samples/Sample"):
             sample = Log.Sample.from_xml(sample_element)
@@ -273,3 +851,159 @@ class Log():
                 log.sample_list += [sample]
 
         return log
+
+    # Subtrees stripped from the raw log before parsing: outside of Log, never yielded by iterparse()
+    STRIPPED_TAGS = ["DeviceInfo", "PersonalSettings"]
+
+    # Size of the chunks read from log files
+    CHUNK_SIZE = 64 * 1024
+
+    @staticmethod
+    def read_stripped(log_file: typing.BinaryIO, tag_list: List[str]):
+        """Yield the content of a log file by chunks, with the subtrees of tag_list stripped
+
+        Stripping as raw text is much cheaper than parsing subtrees to drop them.
+        A subtree cut by the end of a chunk is kept for the next one, except if
+        its start tag itself is cut, then it is just not stripped.
+        """
+
+        tags_pattern = b"|".join(re.escape(tag.encode()) for tag in tag_list)
+        subtree_regex = re.compile(rb"<(" + tags_pattern + rb")>.*?</\1>", re.DOTALL)
+        start_regex = re.compile(rb"<(?:" + tags_pattern + rb")>")
+
+        pending = b""
+        for chunk in iter(lambda: log_file.read(Log.CHUNK_SIZE), b""):
+            data = subtree_regex.sub(b"", pending + chunk)
+            # Start tags left are of subtrees not complete yet
+            match = start_regex.search(data)
+            if match:
+                pending = data[match.start():]
+                data = data[:match.start()]
+            else:
+                pending = b""
+            if data:
+                yield data
+
+        if pending:
+            yield pending
+
+    @staticmethod
+    def iterparse(log_file_path: str, projection: Log.Projection | None = None):
+        """Yield Log/Header, then each Log/Samples/Sample element, as soon as it is complete
+
+        Elements are cleared once consumed, as is everything outside of Log
+        (DeviceInfo, PersonalSettings, ...), so memory stays flat whatever the log length.
+        With projection, samples of types it does not keep are dropped, and bulky
+        subtrees it does not keep (Log.Projection.SUBTREE_TAGS) are not even parsed.
+        """
+
+        strip_tag_list = list(Log.STRIPPED_TAGS)
+        if projection is not None:
+            strip_tag_list += [tag for tag in Log.Projection.SUBTREE_TAGS if tag not in projection.subtree_tags]
+
+        # Elements currently open, from root to innermost
+        element_stack: List[etree.Element] = []
+
+        parser = etree.XMLPullParser(events=("start", "end"))
+
+        with open(log_file_path, "rb") as log_file:
+
+            for data in itertools.chain(Log.read_stripped(log_file, strip_tag_list), [None]):
+
+                if data is None:
+                    parser.close()
+                else:
+                    parser.feed(data)
+
+                for event, element in parser.read_events():
+
+                    if event == "start":
+                        element_stack += [element]
+                        continue
+
+                    element_stack.pop()
+                    # 1 = openambitlog/*, 2 = openambitlog/Log/*, 3 = openambitlog/Log/Samples/*
+                    depth = len(element_stack)
+
+                    if depth == 3 and element.tag == "Sample":
+                        if projection is None or projection.keeps_type(element.findtext("Type")):
+                            yield element
+                    elif depth == 2 and element.tag == "Header":
+                        yield element
+                    elif depth != 1:
+                        # Kept until its parent is complete
+                        continue
+
+                    # Element consumed, drop it from its parent
+                    element.clear()
+                    element_stack[-1].remove(element)
+
+    @classmethod
+    def iter_samples(cls, log_file_path: str):
+        """Yield Log.Sample objects of a log file, decoded while streaming through it"""
+        element_iter = Log.iterparse(log_file_path, Log.Projection.for_decoding())
+        return Log.samples_from_xml(element for element in element_iter if element.tag == "Sample")
+
+    @classmethod
+    def from_file(cls, log_file_path: str, streaming: bool = False, cache: bool = False):
+        """Read a log file
+
+        With streaming, only Header is parsed upfront, and sample_list is a
+        generator decoding samples from the file as it is iterated (only once)
+        With cache, the log is read from its Log.Cache file, written first if
+        missing or stale, and sample_list is a generator as with streaming
+        """
+
+        logger = logging.getLogger("Log::from_file")
+
+        if cache:
+            log_cache = Log.Cache.load(log_file_path)
+            if log_cache:
+                return log_cache.to_log()
+
+            # Before decoding, not to cache a log changed while decoded as the previous one
+            stat = os.stat(log_file_path)
+            sha256 = file_sha256(log_file_path)
+
+            log = Log.from_file(log_file_path, streaming=True)
+            if not log:
+                return None
+
+            log_cache = Log.Cache.from_log(log)
+            try:
+                log_cache.save(log_file_path, stat, sha256)
+            except OSError as exc:
+                logger.warning("Save %s FAILED (%s)", Log.Cache.get_file_path(log_file_path), exc)
+
+            return log_cache.to_log()
+
+        if not streaming:
+            root = etree.parse(log_file_path)
+            log_element = root.find("Log")
+            if not log_element:
+                logger.error("Get Log FAILED")
+                return None
+            return Log.from_xml(log_element)
+
+        element_iter = Log.iterparse(log_file_path, Log.Projection.for_decoding())
+
+        header = next(element_iter, None)
+        if header is None or header.tag != "Header":
+            logger.error("Get Header FAILED")
+            return None
+
+        log = Log.from_header_xml(header)
+        if not log:
+            return None
+
+        log.sample_list = Log.samples_from_xml(element_iter)
+
+        return log
+
+    @classmethod
+    def samples_from_xml(cls, sample_elements: Iterable[etree.Element]):
+        """Yield Log.Sample objects decoded from Sample elements, skipping unhandled ones"""
+        for element in sample_elements:
+            sample = Log.Sample.from_xml(element)
+            if sample:
+                yield sample
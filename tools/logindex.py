@@ -0,0 +1,285 @@
+#!/usr/bin/python
+
+""" SQLite index of the logs of a dir, to find moves without opening any log.
+usage: ./logindex.py LOG_DIR update
+       ./logindex.py LOG_DIR query [-t TYPE] [-y YEAR] [--min-km KM] ...
+"""
+
+from __future__ import annotations
+
+from argparse import ArgumentParser
+from collections import Counter
+from dataclasses import dataclass, fields
+from datetime import datetime
+import glob
+import logging
+import os
+import sqlite3
+import sys
+
+from log import Log
+from filehash import file_sha256
+
+LOG_LEVEL_DEFAULT = logging.INFO
+LOG_LEVEL_VERBOSE = logging.DEBUG
+LOG_FMT = "[%(levelname)5s][%(name)12s] %(message)s"
+
+@dataclass
+class Move():
+    """Header fields and summary of a log, a row of the index"""
+
+    log_file_path: str
+    size: int
+    mtime_ns: int
+    sha256: str
+    # Log.DATETIME_FMT
+    _datetime: str
+    activity: str | None
+    activity_type: int | None
+    activity_type_name: str | None
+    # ms
+    duration: int | None
+    # m
+    distance: int | None
+    # m
+    ascent: int | None
+    descent: int | None
+    # bpm
+    hr_avg: int | None
+    hr_max: int | None
+    # 0.1 degree C
+    temperature_min: int | None
+    temperature_max: int | None
+    # kcal
+    energy: int | None
+    sample_count: int
+    gps_sample_count: int
+    lap_count: int
+
+    # Header path of fields read from it, others are computed
+    HEADER_PATHS = {
+        "_datetime": "DateTime",
+        "activity": "Activity",
+        "activity_type": "ActivityType",
+        "activity_type_name": "ActivityTypeName",
+        "duration": "Duration",
+        "distance": "Distance",
+        "ascent": "Ascent",
+        "descent": "Descent",
+        "hr_avg": "HR/Avg",
+        "hr_max": "HR/Max",
+        "temperature_min": "Temperature/Min",
+        "temperature_max": "Temperature/Max",
+        "energy": "Energy",
+    }
+
+    GPS_SAMPLE_TYPES = ["gps-base", "gps-small", "gps-tiny"]
+
+    @classmethod
+    def from_file(cls, log_file_path: str, stat: os.stat_result, sha256: str):
+        """Read Header fields, and count samples per type (samples are not decoded)"""
+
+        logger = logging.getLogger("Move::from_file")
+
+        element_iter = Log.iterparse(log_file_path, Log.Projection())
+
+        header = next(element_iter, None)
+        if header is None or header.tag != "Header":
+            logger.error("Get Header FAILED")
+            return None
+
+        header_dict = {}
+        for name, path in Move.HEADER_PATHS.items():
+            value = header.findtext(path) or None
+            if value is not None and name not in ["_datetime", "activity", "activity_type_name"]:
+                value = int(value)
+            header_dict[name] = value
+
+        if not header_dict["_datetime"]:
+            logger.error("Get Header/DateTime FAILED")
+            return None
+
+        type_counter = Counter(element.findtext("Type") for element in element_iter)
+
+        return Move(os.path.abspath(log_file_path), stat.st_size, stat.st_mtime_ns, sha256,
+            sample_count=sum(type_counter.values()),
+            gps_sample_count=sum(type_counter[type] for type in Move.GPS_SAMPLE_TYPES),
+            lap_count=type_counter["lap-info"],
+            **header_dict)
+
+@dataclass
+class LogIndex():
+    """Moves of a log dir in a SQLite database, updated incrementally
+
+    A log is indexed again only if changed (size and mtime, or else content hash)
+    """
+
+    FILE_NAME = ".openambit-index.sqlite"
+
+    connection: sqlite3.Connection
+
+    @classmethod
+    def open(cls, db_file_path: str):
+
+        connection = sqlite3.connect(db_file_path)
+        connection.row_factory = sqlite3.Row
+
+        column_list = []
+        for _field in fields(Move):
+            sql_type = "INTEGER" if _field.type in ["int", "int | None"] else "TEXT"
+            column_list += [f"{_field.name} {sql_type}"]
+        connection.execute(f"CREATE TABLE IF NOT EXISTS move ({', '.join(column_list)}, PRIMARY KEY (log_file_path))")
+        connection.execute("CREATE INDEX IF NOT EXISTS move_datetime ON move (_datetime)")
+        connection.execute("CREATE INDEX IF NOT EXISTS move_activity_type_name ON move (activity_type_name)")
+        connection.commit()
+
+        return LogIndex(connection)
+
+    def close(self):
+        self.connection.close()
+
+    def update(self, log_dir_path: str):
+        """Index new and changed logs of log_dir_path, drop deleted ones
+
+        Return (indexed count, failed count)
+        """
+
+        logger = logging.getLogger("LogIndex::update")
+
+        # Key = log file path, value = (size, mtime_ns, sha256)
+        indexed_dict = {row["log_file_path"]: (row["size"], row["mtime_ns"], row["sha256"])
+            for row in self.connection.execute("SELECT log_file_path, size, mtime_ns, sha256 FROM move")}
+
+        log_file_path_set = set()
+        indexed_count = 0
+        failed_count = 0
+
+        for log_file_path in sorted(glob.glob(os.path.join(log_dir_path, "*.log"))):
+
+            log_file_path = os.path.abspath(log_file_path)
+            log_file_path_set.add(log_file_path)
+
+            stat = os.stat(log_file_path)
+            indexed = indexed_dict.get(log_file_path)
+            if indexed and indexed[0] == stat.st_size and indexed[1] == stat.st_mtime_ns:
+                continue
+
+            sha256 = file_sha256(log_file_path)
+            if indexed and indexed[0] == stat.st_size and indexed[2] == sha256:
+                # Touched or copied again, content unchanged
+                self.connection.execute("UPDATE move SET mtime_ns = ? WHERE log_file_path = ?",
+                    (stat.st_mtime_ns, log_file_path))
+                continue
+
+            logger.debug("Index %s", log_file_path)
+            try:
+                move = Move.from_file(log_file_path, stat, sha256)
+            except Exception as exc:
+                logger.error("Index %s FAILED (%s: %s)", log_file_path, type(exc).__name__, exc)
+                move = None
+            if not move:
+                failed_count += 1
+                continue
+
+            values = [getattr(move, _field.name) for _field in fields(Move)]
+            self.connection.execute(f"INSERT OR REPLACE INTO move VALUES ({', '.join('?' * len(values))})", values)
+            indexed_count += 1
+
+        # Deleted logs of the dir
+        log_dir_abs_path = os.path.abspath(log_dir_path)
+        for log_file_path in indexed_dict:
+            if os.path.dirname(log_file_path) == log_dir_abs_path and log_file_path not in log_file_path_set:
+                self.connection.execute("DELETE FROM move WHERE log_file_path = ?", (log_file_path,))
+
+        self.connection.commit()
+
+        return indexed_count, failed_count
+
+    def query(self, activity_type_name: str = "", activity: str = "", since: datetime | None = None,
+            until: datetime | None = None, min_distance: int | None = None, max_distance: int | None = None):
+        """Moves matching all criteria given, in chronological order
+
+        since is included, until excluded, distances are in m
+        """
+
+        where_list = []
+        params = []
+        if activity_type_name:
+            where_list += ["activity_type_name = ? COLLATE NOCASE"]
+            params += [activity_type_name]
+        if activity:
+            where_list += ["activity LIKE ?"]
+            params += [f"%{activity}%"]
+        if since:
+            where_list += ["_datetime >= ?"]
+            params += [since.strftime(Log.DATETIME_FMT)]
+        if until:
+            where_list += ["_datetime < ?"]
+            params += [until.strftime(Log.DATETIME_FMT)]
+        if min_distance is not None:
+            where_list += ["distance >= ?"]
+            params += [min_distance]
+        if max_distance is not None:
+            where_list += ["distance <= ?"]
+            params += [max_distance]
+
+        sql = "SELECT * FROM move"
+        if where_list:
+            sql += f" WHERE {' AND '.join(where_list)}"
+        sql += " ORDER BY _datetime"
+
+        return [Move(**row) for row in self.connection.execute(sql, params)]
+
+def main():
+    parser = ArgumentParser(prog="logindex", description="Index of Ambit logs of a dir")
+    parser.add_argument("log_dir", help="Path to log dir")
+    parser.add_argument("--db", default="", help=f"Path to index, default is LOG_DIR/{LogIndex.FILE_NAME}")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("update", help="Index new and changed logs")
+    query_parser = subparsers.add_parser("query", help="List moves matching all criteria given")
+    query_parser.add_argument("-t", "--type", default="", help="ActivityTypeName, e.g. Running")
+    query_parser.add_argument("-a", "--activity", default="", help="Part of Activity (name)")
+    query_parser.add_argument("-y", "--year", type=int, help="Year")
+    query_parser.add_argument("--since", type=datetime.fromisoformat, help="Start date, included")
+    query_parser.add_argument("--until", type=datetime.fromisoformat, help="End date, excluded")
+    query_parser.add_argument("--min-km", type=float, help="Minimum distance, km")
+    query_parser.add_argument("--max-km", type=float, help="Maximum distance, km")
+    query_parser.add_argument("-u", "--update", action="store_true", help="Index new and changed logs first")
+    args = parser.parse_args()
+
+    log_level = LOG_LEVEL_DEFAULT
+    if args.verbose:
+        log_level = LOG_LEVEL_VERBOSE
+    logging.basicConfig(format=LOG_FMT, level=log_level)
+
+    logger = logging.getLogger("main")
+
+    log_index = LogIndex.open(args.db or os.path.join(args.log_dir, LogIndex.FILE_NAME))
+
+    if args.command == "update" or args.update:
+        indexed_count, failed_count = log_index.update(args.log_dir)
+        logger.info("%d logs indexed, %d FAILED", indexed_count, failed_count)
+        if failed_count and args.command == "update":
+            sys.exit(1)
+
+    if args.command == "query":
+        since = args.since
+        until = args.until
+        if args.year:
+            since = max(since or datetime.min, datetime(args.year, 1, 1))
+            until = min(until or datetime.max, datetime(args.year + 1, 1, 1))
+        move_list = log_index.query(args.type, args.activity, since, until,
+            round(args.min_km * 1000) if args.min_km is not None else None,
+            round(args.max_km * 1000) if args.max_km is not None else None)
+        for move in move_list:
+            duration = f"{move.duration // 3600000}:{move.duration // 60000 % 60:02d}" if move.duration else "-"
+            distance = f"{move.distance / 1000:.2f} km" if move.distance is not None else "-"
+            print(f"{move._datetime} {move.activity_type_name or '-':>16} {move.activity or '-':>24} "
+                f"{duration:>6} {distance:>10} {move.log_file_path}")
+        logger.info("%d moves", len(move_list))
+
+    log_index.close()
+
+if __name__ == "__main__":
+    main()
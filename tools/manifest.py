@@ -0,0 +1,88 @@
+
+from __future__ import annotations
+
+from dataclasses import asdict, dataclass, field
+import json
+import logging
+import os
+from typing import Dict
+
+from filehash import file_sha256
+
+@dataclass
+class Manifest():
+    """Index of the logs converted to an output dir, so that only changed ones are converted again
+
+    A log is up to date if it has not changed (same size and mtime, or else
+    same content hash) and was converted by the same converter version.
+    Only successful conversions are recorded, failed ones are retried.
+    """
+
+    FILE_NAME = ".openambit2x-manifest.json"
+
+    @dataclass
+    class Entry():
+        size: int
+        mtime_ns: int
+        sha256: str
+        converter: str
+        # Empty in manifests which recorded failed conversions
+        x_file_path: str = ""
+
+    file_path: str
+    # Key = absolute log file path
+    entry_dict: Dict[str, Manifest.Entry] = field(default_factory=dict)
+
+    @classmethod
+    def load(cls, dir_path: str):
+
+        logger = logging.getLogger("Manifest::load")
+
+        manifest = Manifest(os.path.join(dir_path, Manifest.FILE_NAME))
+
+        if not os.path.isfile(manifest.file_path):
+            return manifest
+
+        try:
+            with open(manifest.file_path, "r") as manifest_file:
+                for log_file_path, entry in json.load(manifest_file).items():
+                    manifest.entry_dict[log_file_path] = Manifest.Entry(**entry)
+        except (OSError, ValueError, TypeError) as exc:
+            logger.warning("Load %s FAILED (%s), start from scratch", manifest.file_path, exc)
+            manifest.entry_dict = {}
+
+        return manifest
+
+    def save(self):
+        # Write aside then rename, not to leave a truncated manifest if interrupted
+        tmp_file_path = f"{self.file_path}.tmp"
+        with open(tmp_file_path, "w") as manifest_file:
+            json.dump({log_file_path: asdict(entry) for log_file_path, entry in self.entry_dict.items()},
+                manifest_file, indent=1)
+        os.replace(tmp_file_path, self.file_path)
+
+    def is_up_to_date(self, log_file_path: str, stat: os.stat_result, converter: str):
+        """Whether log was converted by converter, and has not changed since"""
+
+        entry = self.entry_dict.get(os.path.abspath(log_file_path))
+        if not entry or entry.converter != converter or entry.size != stat.st_size:
+            return False
+
+        if not entry.x_file_path or not os.path.isfile(entry.x_file_path):
+            return False
+
+        if entry.mtime_ns != stat.st_mtime_ns:
+            # Touched or copied again, only hash tells whether content changed
+            if entry.sha256 != file_sha256(log_file_path):
+                return False
+            entry.mtime_ns = stat.st_mtime_ns
+
+        return True
+
+    def update(self, log_file_path: str, stat: os.stat_result, sha256: str, converter: str, x_file_path: str):
+        self.entry_dict[os.path.abspath(log_file_path)] = Manifest.Entry(
+            stat.st_size, stat.st_mtime_ns, sha256, converter, x_file_path)
+
+    def remove(self, log_file_path: str):
+        """Forget a log, e.g. whose conversion failed, so that it is converted again"""
+        self.entry_dict.pop(os.path.abspath(log_file_path), None)
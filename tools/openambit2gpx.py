@@ -7,226 +7,229 @@ usage: ./openambit2gpx.py inputfile outputFile
 #from lxml import etree # does not allow namespace prefixes which are required for gpx extensions; everything else in this script would work otherwise with lxml 
 import os
 import argparse
+import itertools
+import operator
+import re
 import xml.etree.ElementTree as etree
-import math
+from xml.sax.saxutils import escape
 
-# Look at http://www.topografix.com/GPX/1/1/gpx.xsd and https://www8.garmin.com/xmlschemas/TrackPointExtensionv2.xsd for XML Schemata for GPX files
+from align import Alignment
+from hr import HeartRate
+from log import Log
+from track import Track
 
-def utcSplitConvSeconds(utcTime):
-    """ Splits the UTC time code YYYY-MM-DDTHH:MM:SS.SSSZ, keeps only the time part and converts it into seconds.
-    """
+# Look at http://www.topografix.com/GPX/1/1/gpx.xsd and https://www8.garmin.com/xmlschemas/TrackPointExtensionv2.xsd for XML Schemata for GPX files
 
-    import math
-    tmpTime=utcTime.split("T")[1].split("Z")[0].split(":")
-    tmpDay=int(utcTime.split("T")[0].split("-")[2])
-    secs=float(tmpDay)*24*3600 + float(tmpTime[0])*3600 + float(tmpTime[1])*60 + float(tmpTime[2])
+class gpxEtreeWriter(object):
+    """ Writes each trkpt by building an ElementTree element and serializing it. """
 
-    return secs
+    def __init__(self, fOut):
+        self.fOut = fOut
 
-def timeDiff(utcTime1,utcTime2):
-    """ Computes the difference, in seconds, between an earlier (utcTime1) and a later date (utcTime2). Only safe for dates within the same month or less than 2 days apart if on the boundary of a month.
+    def writeTrkpt(self, lat, lon, ele, time, hr, cadence, power, temp, speed, airpressure):
+        trk=etree.Element("trkpt")
+        trk.set("lat",lat)
+        trk.set("lon",lon)
+
+        if ele!=None: etree.SubElement(trk,"ele").text=ele
+        if time!=None: etree.SubElement(trk,"time").text=time
+
+        if hr!=None or cadence!=None or power!=None or speed!=None or temp!=None or airpressure!=None:
+            extGpx=etree.SubElement(trk,"extensions")
+            if hr!=None: etree.SubElement(extGpx,"gpxdata:hr").text=hr
+            if cadence!=None: etree.SubElement(extGpx,"gpxdata:cadence").text=cadence
+            if power!=None: etree.SubElement(extGpx,"gpxdata:power").text=power
+            if temp!=None: etree.SubElement(extGpx,"gpxdata:temp").text=temp
+            if speed!=None: etree.SubElement(extGpx,"gpxdata:speed").text=speed
+            if airpressure!=None: etree.SubElement(extGpx,"gpxdata:SeaLevelPressure").text=airpressure
+
+        self.fOut.write("   "+etree.tostring(trk).decode()+"\n")
+
+    def flush(self):
+        pass
+
+class gpxTextWriter(object):
+    """ Formats each trkpt straight to text, same output as gpxEtreeWriter,
+    buffered and written out by chunks of bufferSize trkpts.
+    Values (numbers and UTC times) are only run through escape() if one of them holds a character to escape.
     """
 
-    secs1=utcSplitConvSeconds(utcTime1)
-    secs2=utcSplitConvSeconds(utcTime2)
-
-    if int(utcTime2.split("T")[0].split("-")[2])==1:
-        secs1-=float(utcTime2.split("T")[0].split("-")[2])*24*3600 # if second date is on a first of a month, then the previous day gets reset to day 0 of the same month
-
-    return secs2-secs1
-
-class ibiToHr(object):
-    def __init__(self, average_hr=False):
-        self.ibitimeLast = None
-        self.hrLast = 0
-        self.hrlist = []
-        self.average_hr = average_hr
-
-    def ibiToHr(self, element):
-        '''Parse a list of IBI times to heart rates, always return some hr rate'''
-        sampType = element.findtext("Type")
-
-        if sampType == 'ibi':
-            ibitime = element.findtext("Time")
-            if self.ibitimeLast != ibitime:
-                self.hrlist = [int(element.text) for element in element.findall('IBI')]
-
-                if self.average_hr:
-                    # filter 1: average hr data, flatten data
-                    ibi_avg = sum(self.hrlist) / len(self.hrlist)
-                    self.hrlist = [ibi_avg]
+    ATTRIB_ENTITIES = {'"': "&quot;", "\n": "&#10;", "\r": "&#13;", "\t": "&#09;"}
+    NEEDS_ESCAPE = re.compile('[&<>"\n\r\t]').search
+
+    def __init__(self, fOut, bufferSize=1000):
+        self.fOut = fOut
+        self.bufferSize = bufferSize
+        self.buffer = []
+
+    @staticmethod
+    def element(tag, text):
+        return "<%s>%s</%s>" % (tag, text, tag) if text else "<%s />" % tag
+
+    def writeTrkpt(self, lat, lon, ele, time, hr, cadence, power, temp, speed, airpressure):
+        # Checked once for all values, escaping is the exception
+        if self.NEEDS_ESCAPE("".join([value for value in (lat, lon, ele, time, hr, cadence, power, temp, speed, airpressure) if value])):
+            lat=escape(lat, self.ATTRIB_ENTITIES)
+            lon=escape(lon, self.ATTRIB_ENTITIES)
+            ele, time, hr, cadence, power, temp, speed, airpressure=[escape(value) if value else value
+                for value in (ele, time, hr, cadence, power, temp, speed, airpressure)]
+
+        element=self.element
+        children=[]
+        if ele!=None: children.append(element("ele", ele))
+        if time!=None: children.append(element("time", time))
+
+        if hr!=None or cadence!=None or power!=None or speed!=None or temp!=None or airpressure!=None:
+            children.append("<extensions>")
+            if hr!=None: children.append(element("gpxdata:hr", hr))
+            if cadence!=None: children.append(element("gpxdata:cadence", cadence))
+            if power!=None: children.append(element("gpxdata:power", power))
+            if temp!=None: children.append(element("gpxdata:temp", temp))
+            if speed!=None: children.append(element("gpxdata:speed", speed))
+            if airpressure!=None: children.append(element("gpxdata:SeaLevelPressure", airpressure))
+            children.append("</extensions>")
+
+        if children:
+            self.buffer.append('   <trkpt lat="%s" lon="%s">%s</trkpt>\n' % (lat, lon, "".join(children)))
+        else:
+            self.buffer.append('   <trkpt lat="%s" lon="%s" />\n' % (lat, lon))
+
+        if len(self.buffer) >= self.bufferSize:
+            self.flush()
+
+    def flush(self):
+        self.fOut.write("".join(self.buffer))
+        self.buffer = []
+
+GPX_WRITERS = {"text": gpxTextWriter, "etree": gpxEtreeWriter}
+
+# Samples read by convert_parsed_log_to_gpx, others (e.g. position) and gps-base Satellites are dropped while parsing
+GPX_PROJECTION = Log.Projection(frozenset([
+    Log.PeriodicSample.type,
+    Log.IbiSample.type,
+    Log.LapInfoSample.type,
+    Log.GpsBaseSample.type,
+    Log.GpsSmallSample.type,
+    Log.GpsTinySample.type,
+]))
+
+def sampleFields(element):
+    """ Maps the tag of each child of a sample to its text, in a single pass over the children.
+    As with findtext(), the first occurrence of a tag wins and an empty element gives "".
+    """
 
-            self.ibitimeLast = ibitime
+    # Reversed, so that the first occurrence is the one assigned last
+    return {child.tag: child.text or "" for child in reversed(element)}
 
-        if len(self.hrlist) > 0:
-            # take first element of list to convert to HR
-            hr = 60./ (self.hrlist[0] / 1000.)  # convert IBI to beats/min
-            del self.hrlist[0]
-        else:
-            # no data is available anymore
-            hr = self.hrLast
+def gpxFields(element):
+    """ sampleFields(), with the IBI list of ibi samples as ints, and the Lap of lap-info samples decoded (None if invalid).
+    """
 
-        #filter 2: sensor errors
-        hrmin = 40  # Mimimum heart rate for humans
-        hrmax = 220  # Maximum heart rate for hiumans
-        if hr > hrmax or  hr < hrmin: 
-            hr = self.hrLast
-        
-        self.hrLast = hr
-        ret = None if self.hrLast == 0 else str(int(self.hrLast))
-        return ret
+    fields=sampleFields(element)
+    sampType=fields.get("Type")
+    if sampType=="ibi":
+        fields["IBI"]=[int(ibi.text) for ibi in element.findall("IBI")]
+    elif sampType=="lap-info":
+        lapElement=element.find("Lap")
+        fields["Lap"]=Log.LapInfoSample.Lap.from_xml(lapElement) if lapElement is not None else None
+    return fields
+
+def gpxIsTrkpt(fields):
+    # Position samples just repeat positional/time information in the previous gps-base sample
+    # Thus simply skip these to avoid creating duplicate gpx trkpts
+    return bool(fields.get("Latitude")) and bool(fields.get("Longitude")) and fields.get("Type")!="position"
+
+def gpxAlignment(average_hr=True):
+    """ Aligns the sensor values of samples, as gpxFields() dicts, onto their GPS points (trkpts), lap-info samples being kept in between.
+    The values of a trkpt are the last ones at or before it, HR being the one of periodic samples if any, else from IBI.
+    """
 
+    def field(tag, kinds=None):
+        return Alignment.Channel(lambda fields: fields.get(tag) or None, kinds)
+
+    periodic=frozenset(["periodic"])
+
+    return Alignment({
+        "utc": field("UTC"),
+        "altitude": field("Altitude", periodic),
+        "hr": field("HR", periodic),
+        "cadence": field("Cadence", periodic),
+        "power": field("BikePower", periodic),
+        "speed": field("Speed", periodic),
+        "temp": field("Temperature", periodic),
+        "airpressure": field("SeaLevelPressure", periodic),
+        "ibiHr": Alignment.Channel(lambda fields: HeartRate.sample_hr(fields["IBI"], average_hr), frozenset(["ibi"])),
+    }, lambda fields: fields.get("Type")=="lap-info" or gpxIsTrkpt(fields), operator.methodcaller("get", "Type"))
+
+def main(fileIn, fileOut, average_hr=True, writer="text"):
+    elementIter=Log.iterparse(fileIn, GPX_PROJECTION)
+
+    headerElement=next(elementIter, None)
+    if headerElement is not None and headerElement.tag!="Header":
+        # No header, this is already the first sample
+        elementIter=itertools.chain([headerElement], elementIter)
+        headerElement=None
+
+    return convert_parsed_log_to_gpx(headerElement, elementIter, fileOut, average_hr, writer)
+
+def convert_parsed_log_to_gpx(headerElement, sampleElements, fileOut, average_hr=True, writer="text"):
+    """ Converts already parsed Header and Sample elements, e.g. from Log.iterparse(), projected on GPX_PROJECTION or wider.
+    headerElement is read before the first sample is pulled from sampleElements.
+    writer is the name of the trkpt writer, in GPX_WRITERS.
+    """
 
-def main(fileIn, fileOut, average_hr=True):
     ###########################################
     ## setting variables up, starting output ##
     ###########################################
 
-    rootIn=etree.parse(fileIn)
     fOut=open(fileOut, 'w')
 
     fOut.write("<?xml version=\"1.0\" encoding=\"UTF-8\" standalone=\"no\" ?>\n\n")
     fOut.write('<gpx xmlns="http://www.topografix.com/GPX/1/1" version="1.1" creator="openambit2gpx" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:gpxdata="http://www.cluetrust.com/XML/GPXDATA/1/0" xsi:schemaLocation="http://www.topografix.com/GPX/1/1 http://www.topografix.com/GPX/1/1/gpx.xsd http://www.cluetrust.com/XML/GPXDATA/1/0 http://www.cluetrust.com/Schemas/gpxdata10.xsd">\n')
     fOut.write(" <trk>\n")
 
-    header_element = rootIn.find("Log/Header")
-    if header_element:
-        activity = header_element.findtext("Activity")
+    if headerElement:
+        activity = headerElement.findtext("Activity")
         if activity:
             fOut.write(f"  <name>{activity}</name>\n")
-        activity_type = header_element.findtext("ActivityTypeName")
+        activity_type = headerElement.findtext("ActivityTypeName")
         if activity_type:
             fOut.write(f"  <type>{activity_type.lower()}</type>\n")
 
     fOut.write("  <trkseg>\n")
 
-    latLast=None
-    lonLast=None
-    timeLast=None
-    altitudeLast=None
-    hrLast=None
-    cadenceLast=None
-    powerLast=None
-    speedLast=None
-    tempLast=None
-    airpressureLast=None
-    latLatest=None
-    lonLatest=None
-    timeGPSLatest=None
+    trkptWriter=GPX_WRITERS[writer](fOut)
 
-    lapCount=0
-    lapArray=[0]
-    maxLap=0
+    # (Time, UTC, Lap) of lap-info samples, Time (ms) locates lap points on the track
+    lapArray=[]
+    # Lap points are interpolated in Time between trkpts
+    track=Track()
 
     ###########################
     ## getting activity data ##
     ###########################
-    ibiconvertor = ibiToHr(average_hr=average_hr)
-
-    for element in rootIn.iterfind("Log/Samples/Sample"):
+    for fields, values in gpxAlignment(average_hr).rows(gpxFields(element) for element in sampleElements):
 
-        # Position samples just repeat positional/time information in the previous gps-base sample
-        # Thus simply skip these to avoid creating duplicate gpx trkpts
-        sampType=element.findtext("Type")
-        if sampType=="position":
+        if fields.get("Type")=="lap-info":
+            if fields["Lap"] is not None:
+                lapArray.append((int(fields.get("Time") or 0), fields.get("UTC", ""), fields["Lap"]))
             continue
 
-        trk=etree.Element("trkpt")
-
-        lat=element.findtext("Latitude")
-        lon=element.findtext("Longitude")
-        time=element.findtext("UTC")
-
-        altitude=element.findtext("Altitude") if element.findtext("Altitude")!=None else altitudeLast
-        hr=element.findtext("HR") if element.findtext("HR")!=None else hrLast
-        if hr == None:
-            hr = ibiconvertor.ibiToHr(element)
-
-        cadence=element.findtext("Cadence") if element.findtext("Cadence")!=None else cadenceLast
-        power=element.findtext("BikePower") if element.findtext("BikePower")!=None else powerLast
-        speed=str(float(element.findtext("Speed"))/100) if element.findtext("Speed")!=None else speedLast
-        temp=str(float(element.findtext("Temperature"))/10) if element.findtext("Temperature")!=None else tempLast
-        airpressure=element.findtext("SeaLevelPressure") if element.findtext("SeaLevelPressure")!=None else airpressureLast
-
-        if sampType=="lap-info":
-            lapType=element.findtext("Lap/Type")
-            lapDate=element.findtext("Lap/DateTime")
-            lapDuration=element.findtext("Lap/Duration")
-            lapDistance=element.findtext("Lap/Distance")
-            lapUtc=element.findtext("UTC")
-            lapPreviousLat=latLatest
-            lapPreviousLon=lonLatest
-            lapPreviousTime=timeGPSLatest
-            lapCheck=1
+        lat=int(fields["Latitude"])
+        lon=int(fields["Longitude"])
+        track.append(int(fields.get("Time") or 0), lat, lon)
 
-            if lapCount==0:
-                lapArray[0]=[lapType,lapDate,lapDuration,lapDistance,lapUtc,lapPreviousLat,lapPreviousLon,lapPreviousTime,0,0,0]
-            else:
-                lapArray.append([lapType,lapDate,lapDuration,lapDistance,lapUtc,lapPreviousLat,lapPreviousLon,lapPreviousTime,0,0,0])
-            lapCount+=1
+        hr=values["hr"]
+        if hr is None and values["ibiHr"] is not None:
+            hr=str(int(values["ibiHr"]))
 
-        maxLap=lapCount-1
-
-        if lat!=None and lon!=None:
-            lat=float(lat)/10000000
-            lon=float(lon)/10000000
-
-            trk.set("lat",str(lat))
-            trk.set("lon",str(lon))
-
-            latLatest=str(lat)
-            lonLatest=str(lon)
-            timeGPSLatest=time
-
-            if lapCheck==1:
-                lapArray[lapCount-1][8]=latLatest
-                lapArray[lapCount-1][9]=lonLatest
-                lapArray[lapCount-1][10]=timeGPSLatest
-                lapCheck=0
-                
-            if altitude!=None:
-                etree.SubElement(trk,"ele").text=altitude 
-            elif altitudeLast!=None:
-                etree.SubElement(trk,"ele").text=altitudeLast
-     
-            if time!=None and len(time) > 0:
-                etree.SubElement(trk,"time").text=time 
-            elif timeLast!=None and len(timeLast) > 0:
-                etree.SubElement(trk,"time").text=timeLast 
-
-            if hr!=None or cadence!=None or power!=None or speed!=None or temp!=None or airpressure!=None:
-                extGpx=etree.SubElement(trk,"extensions")
-                if hr!=None: etree.SubElement(extGpx,"gpxdata:hr").text=hr
-                if cadence!=None: etree.SubElement(extGpx,"gpxdata:cadence").text=cadence
-                if power!=None: etree.SubElement(extGpx,"gpxdata:power").text=power
-                if temp!=None: etree.SubElement(extGpx,"gpxdata:temp").text=temp
-                if speed!=None: etree.SubElement(extGpx,"gpxdata:speed").text=speed
-                if airpressure!=None: etree.SubElement(extGpx,"gpxdata:SeaLevelPressure").text=airpressure
-
-            fOut.write("   "+etree.tostring(trk).decode()+"\n")
-
-        latLast=lat
-        lonLast=lon
-        timeLast=time
-        altitudeLast=altitude
-        hrLast=hr
-        cadenceLast=cadence
-        powerLast=power
-        speedLast=speed
-        tempLast=temp
-        airpressureLast=airpressure
-
-        lat=None
-        lon=None
-        time=None
-        altitude=None
-        hr=None
-        cadence=None
-        power=None
-        speed=None
-        temp=None
-        airpressure=None
+        trkptWriter.writeTrkpt(str(lat/10000000), str(lon/10000000), values["altitude"], values["utc"], hr,
+            values["cadence"], values["power"],
+            str(float(values["temp"])/10) if values["temp"] is not None else None,
+            str(float(values["speed"])/100) if values["speed"] is not None else None,
+            values["airpressure"])
 
+    trkptWriter.flush()
     fOut.write("  </trkseg>\n")
     fOut.write(" </trk>\n")
 
@@ -236,69 +239,49 @@ def main(fileIn, fileOut, average_hr=True):
     #############################
 
     lapCount=0
-    previousEndTime=0
+    previousEndTime=None
+    previousEndPoint=None
 
     fOut.write(" <extensions>\n")
 
-    previousLatEP=0
-    previousLonEP=0
-    for i in range(0,len(lapArray)):
-        if lapArray[i][0]=='Manual':
+    track.sort()
+
+    for i, (lapTime, lapUtc, lapInfo) in enumerate(lapArray):
+        if lapInfo.type=='Manual':
             lap=etree.Element("gpxdata:lap")
             lap.set("xmlns","http://www.cluetrust.com/XML/GPXDATA/1/0")
 
-            startTime=lapArray[0][4] if lapCount==0 else previousEndTime
-            previousEndTime=lapArray[i][4]
+            endTime=lapUtc
+            startTime=lapArray[0][1] if lapCount==0 else previousEndTime
+            previousEndTime=endTime
 
             etree.SubElement(lap,'index').text=str(lapCount)
             etree.SubElement(lap,'startTime').text=startTime
-            etree.SubElement(lap,'elapsedTime').text=str(float(lapArray[i][2])/1000)
-            etree.SubElement(lap,'distance').text=lapArray[i][3]
+            etree.SubElement(lap,'elapsedTime').text=str(lapInfo.duration/1000)
+            etree.SubElement(lap,'distance').text=str(lapInfo.distance)
 
-            latInterPolSP=lapArray[0][8] if lapCount==0 else previousLatEP
-            lonInterPolSP=lapArray[0][9] if lapCount==0 else previousLonEP
-
-            if i==maxLap:
-                latInterPolEP=lapArray[i][5]
+            if lapCount==0:
+                # At the first lap-info (start)
+                startPoint=track.at(lapArray[0][0]) or (0, 0)
             else:
-                t=lapArray[i][4]
-                t1=lapArray[i][7]
-                t2=lapArray[i][10]
-                lat1=float(lapArray[i][5]) if lapArray[i][5]!=None else 0.0
-                lat2=float(lapArray[i][8]) if lapArray[i][8]!=None else 0.0
-                # only try to parse time difference if both times look like valid timestamps
-                if t1 != None and t2 != None and t1 != 0 and t2 != 0 and "T" in t1 and "Z" in t2 and "T" in t1 and "Z" in t2:
-                    latInterPolEP=str( ((lat2-lat1)/timeDiff(t1,t2))*timeDiff(t1,t) + lat1 )
-                else:
-                    print("Failed to interpolate with t1: ", t1, ", t2: ", t2)
-                    latInterPolEP=0
-
-            if i==maxLap:
-                lonInterPolEP=lapArray[i][6]
+                startPoint=previousEndPoint
+
+            if i==len(lapArray)-1:
+                # Last trkpt at or before the end
+                trackIndex=track.index(lapTime)
+                endPoint=track.point(trackIndex) if trackIndex>=0 else (None, None)
             else:
-                t=lapArray[i][4]
-                t1=lapArray[i][7]
-                t2=lapArray[i][10]
-                lon1=float(lapArray[i][6]) if lapArray[i][6]!=None else 0.0
-                lon2=float(lapArray[i][9]) if lapArray[i][9]!=None else 0.0
-                # only try to parse time difference if both times look like valid timestamps
-                if t1 != None and t2 != None and t1 != 0 and t2 != 0 and "T" in t1 and "Z" in t2 and "T" in t1 and "Z" in t2:
-                    lonInterPolEP=str( ((lon2-lon1)/timeDiff(t1,t2))*timeDiff(t1,t) + lon1 )
-                else:
-                    print("Failed to interpolate with t1: ", t1, ", t2: ", t2)
-                    lonInterPolEP=0
-
-            previousLatEP=latInterPolEP
-            previousLonEP=lonInterPolEP
+                endPoint=track.at(lapTime) or (0, 0)
+            previousEndPoint=endPoint
+
             SP=etree.SubElement(lap,'startPoint')
             SP.text=' '
-            SP.set('lat',str(latInterPolSP))
-            SP.set('lon',str(lonInterPolSP))
+            SP.set('lat',str(startPoint[0]))
+            SP.set('lon',str(startPoint[1]))
             EP=etree.SubElement(lap,'endPoint')
             EP.text=' '
-            EP.set('lat',str(latInterPolEP))
-            EP.set('lon',str(lonInterPolEP))
-
+            EP.set('lat',str(endPoint[0]))
+            EP.set('lon',str(endPoint[1]))
             etree.SubElement(lap,'intensity').text='active'
             trigger=etree.SubElement(lap,'trigger')
             trigger.text=' '
@@ -339,8 +322,8 @@ def main(fileIn, fileOut, average_hr=True):
     
 
 # main alias
-def convert_log_to_gpx(fileIn, fileOut, average_hr=True):
-    return main(fileIn, fileOut, average_hr)
+def convert_log_to_gpx(fileIn, fileOut, average_hr=True, writer="text"):
+    return main(fileIn, fileOut, average_hr, writer)
 
 if __name__ == "__main__":
 
@@ -363,10 +346,15 @@ if __name__ == "__main__":
                         )
     parser.add_argument('-no-avg-hr',
                         dest='no_avg_hr',
-                        action='store_false',
+                        action='store_true',
                         help='Do not average hr over 32 heart beats',
                         default=False,
                         )
+    parser.add_argument('-writer',
+                        choices=list(GPX_WRITERS),
+                        help='How trkpts are written: formatted as text (fast) or through ElementTree',
+                        default='text',
+                        )
     args = parser.parse_args()
 
     # Generate output filename if empty
@@ -378,5 +366,5 @@ if __name__ == "__main__":
     if not args.force and os.path.isfile(args.out):
             print('Output file {} already exists. Skip file'.format(args.out))
     else:
-        main(args.log_in, args.out, args.no_avg_hr)
+        main(args.log_in, args.out, not args.no_avg_hr, args.writer)
 
@@ -3,8 +3,8 @@
 from argparse import ArgumentParser
 from datetime import datetime, timedelta
 import logging
-import xml.etree.ElementTree as etree
 
+from align import Alignment
 from log import Log
 from tcx import Tcx
 
@@ -12,7 +12,7 @@ LOG_LEVEL_DEFAULT = logging.INFO
 LOG_LEVEL_VERBOSE = logging.DEBUG
 LOG_FMT = "[%(levelname)5s][%(name)12s] %(message)s"
 
-def convert_log_to_tcx(log_file_path: str, tcx_file_path: str = ""):
+def convert_log_to_tcx(log_file_path: str, tcx_file_path: str = "", cache: bool = False):
 
     logger = logging.getLogger("convert_log_to_tcx")
 
@@ -20,79 +20,76 @@ def convert_log_to_tcx(log_file_path: str, tcx_file_path: str = ""):
         tcx_file_path = f"{log_file_path.removesuffix('.log')}.tcx"
     logger.debug("tcx_file_path = %s", tcx_file_path)
 
-    with open(log_file_path, "r") as log_file:
-        root = etree.parse(log_file)
+    log = Log.from_file(log_file_path, streaming=True, cache=cache)
+    if not log:
+        logger.error("Get Log.from_file FAILED")
+        return
 
-        tcx = Tcx()
+    return convert_parsed_log_to_tcx(log, tcx_file_path)
 
-        log_element = root.find("Log")
-        if not log_element:
-            logger.error("Get Log FAILED")
-            return
+def convert_parsed_log_to_tcx(log: Log, tcx_file_path: str):
 
-        log = Log.from_xml(log_element)
-        if not log:
-            logger.error("Get Log.from_xml FAILED")
-            return
+    start_datetime = log._datetime
+    activity_type_name = log.activity_type_name
+    if log.activity_type_name == "Aerobics":
+        activity_type_name = "workout"
+    activity = Tcx.Activity(id=start_datetime, name=log.activity_name, sport=activity_type_name)
 
-        start_datetime = log._datetime
-        activity_type_name = log.activity_type_name
-        if log.activity_type_name == "Aerobics":
-            activity_type_name = "workout"
-        activity = Tcx.Activity(id=start_datetime, name=log.activity_name, sport=activity_type_name)
+    # Laps are exported as soon as complete, and samples are streamed through
+    # their alignment, so that only one lap is held in memory
+    with Tcx.Writer(tcx_file_path) as tcx_writer:
+        tcx_writer.begin_activity(activity)
+
+        # Trackpoints get the last periodic values and GPS position at or before them
+        alignment = Alignment({
+            "distance": Alignment.Channel.for_attr(Log.PeriodicSample, "distance"),
+            "altitude": Alignment.Channel.for_attr(Log.PeriodicSample, "altitude"),
+            "cadence": Alignment.Channel.for_attr(Log.PeriodicSample, "cadence"),
+            "latitude": Alignment.Channel.for_attr(Log.GpsSmallSample, "latitude"),
+            "longitude": Alignment.Channel.for_attr(Log.GpsSmallSample, "longitude"),
+        }, lambda sample: isinstance(sample, (Log.PeriodicSample, Log.GpsSmallSample, Log.LapInfoSample)))
 
-        gps_available = False
         last_time: int | None = None
-        distance = 0
-        altitude: float | None = None
-        position: Tcx.Activity.Lap.Track.Trackpoint.Position | None = None
         heart_rate: int | None = None
-        cadence: int | None = None
         lap = Tcx.Activity.Lap()
         track = Tcx.Activity.Lap.Track()
 
-        for sample in log.sample_list:
+        for sample, values in alignment.rows(log.sample_list):
+
+            distance = values["distance"] if values["distance"] is not None else 0
+            position: Tcx.Activity.Lap.Track.Trackpoint.Position | None = None
+            if values["latitude"] is not None:
+                position = Tcx.Activity.Lap.Track.Trackpoint.Position(
+                    float(values["latitude"]) / 10000000,
+                    float(values["longitude"]) / 10000000)
 
             if isinstance(sample, Log.PeriodicSample):
 
                 seconds = int(sample.time / 1000)
                 _datetime = start_datetime + timedelta(seconds=seconds)
 
-                if sample.distance is not None:
-                    distance = sample.distance
-                if sample.altitude is not None:
-                    altitude = sample.altitude
-                if sample.cadence is not None:
-                    cadence = sample.cadence
-
-                if not gps_available:
+                # Periodic samples make trackpoints only until GPS is available
+                if position is None:
                     if last_time is None or seconds - last_time >= 5:
                         last_time = seconds
                         trackpoint = Tcx.Activity.Lap.Track.Trackpoint(
                             _datetime,
                             distance=distance,
-                            altitude=altitude,
+                            altitude=values["altitude"],
                             position=position,
                             heart_rate=heart_rate,
-                            cadence=cadence)
+                            cadence=values["cadence"])
                         track.add_trackpoint(trackpoint)
 
             elif isinstance(sample, Log.GpsSmallSample):
-                gps_available = True
-
-                _datetime = sample.utc
-
-                position = Tcx.Activity.Lap.Track.Trackpoint.Position(
-                    float(sample.latitude) / 10000000,
-                    float(sample.longitude) / 10000000)
 
                 trackpoint = Tcx.Activity.Lap.Track.Trackpoint(
-                    _datetime,
+                    sample.utc,
                     distance=distance,
-                    altitude=altitude,
+                    altitude=values["altitude"],
                     position=position,
                     heart_rate=heart_rate,
-                    cadence=cadence)
+                    cadence=values["cadence"])
 
                 track.add_trackpoint(trackpoint)
 
@@ -113,7 +110,7 @@ def convert_log_to_tcx(log_file_path: str, tcx_file_path: str = ""):
                     lap.add_track(track)
                 lap.finalize()
                 if len(lap.track_list) > 0:
-                    activity.add_lap(lap)
+                    tcx_writer.add_lap(lap)
 
                 # New lap
                 last_time = None
@@ -125,15 +122,16 @@ def convert_log_to_tcx(log_file_path: str, tcx_file_path: str = ""):
             lap.add_track(track)
         lap.finalize()
         if len(lap.track_list) > 0:
-            activity.add_lap(lap)
+            tcx_writer.add_lap(lap)
 
-        tcx.add_activity(activity)
-        tcx.export(tcx_file_path)
+        tcx_writer.end_activity()
 
 def main():
     parser = ArgumentParser(prog="openambit2tcx", description="Convert Ambit log file to tcx")
     parser.add_argument("log_path", help="Path to input log file")
     parser.add_argument("-o", "--out", default="", help="Path to output tcx file")
+    parser.add_argument("-c", "--cache", action="store_true",
+        help="Read log from its binary cache file, written next to it if missing or stale")
     parser.add_argument("-v", "--verbose", action="store_true")
     args = parser.parse_args()
 
@@ -142,7 +140,7 @@ def main():
         log_level = LOG_LEVEL_VERBOSE
     logging.basicConfig(format=LOG_FMT, level=log_level)
 
-    convert_log_to_tcx(args.log_path, args.out)
+    convert_log_to_tcx(args.log_path, args.out, args.cache)
 
 if __name__ == "__main__":
     main()
@@ -1,19 +1,55 @@
 #!/usr/bin/python
 
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import glob
+import hashlib
+import inspect
 import logging
 import os
-import xml.etree.ElementTree as etree
+import sys
+import time
 
+from filehash import file_sha256
 from log import Log
-from openambit2gpx import convert_log_to_gpx
-from openambit2tcx import convert_log_to_tcx
+from manifest import Manifest
+from openambit2gpx import GPX_PROJECTION, convert_parsed_log_to_gpx
+from openambit2tcx import convert_parsed_log_to_tcx
 
 LOG_LEVEL_DEFAULT = logging.INFO
 LOG_LEVEL_VERBOSE = logging.DEBUG
 LOG_FMT = "[%(levelname)5s][%(name)12s] %(message)s"
 
+def converter_source_files():
+    """Source files of this module, of the converters, and of the local modules they use, recursively"""
+
+    dir_path = os.path.dirname(os.path.abspath(__file__))
+    file_path_set = {os.path.abspath(__file__)}
+    module_list = [inspect.getmodule(convert_parsed_log_to_gpx), inspect.getmodule(convert_parsed_log_to_tcx)]
+    while module_list:
+        module = module_list.pop()
+        file_path = getattr(module, "__file__", None)
+        if not file_path or os.path.dirname(os.path.abspath(file_path)) != dir_path:
+            continue
+        file_path = os.path.abspath(file_path)
+        if file_path in file_path_set:
+            continue
+        file_path_set.add(file_path)
+        # Imported modules, and modules of imported classes and functions
+        module_list += [inspect.getmodule(value) for value in vars(module).values()]
+
+    return sorted(file_path_set)
+
+def converter_version(average_hr: bool):
+    """Hash of converters source code and options, changes whenever output may"""
+    sha256 = hashlib.sha256(f"average_hr={average_hr}".encode())
+    for source_file_path in converter_source_files():
+        with open(source_file_path, "rb") as source_file:
+            sha256.update(source_file.read())
+    return sha256.hexdigest()[:16]
+
 def convert_log_to_x(log_file_path: str, out_dir_path: str = "", average_hr=True):
+    """Convert a log file to tcx (Aerobics) or gpx (others, or no activity type), return output file path, None on error"""
 
     logger = logging.getLogger("convert_log_to_x")
 
@@ -26,43 +62,167 @@ def convert_log_to_x(log_file_path: str, out_dir_path: str = "", average_hr=True
         out_dir_path = f"{log_file_path.removesuffix('.log')}"
     logger.debug("out_dir_path = %s", out_dir_path)
 
-    with open(log_file_path, "r") as log_file:
-        root = etree.parse(log_file)
-
-        log_element = root.find("Log")
-        if not log_element:
-            logger.error("Get Log FAILED")
-            return
+    # Header tells which converter, samples are parsed for both
+    element_iter = Log.iterparse(log_file_path, Log.Projection.for_decoding().union(GPX_PROJECTION))
+
+    # Only peek at Header here, samples are parsed once, while converting
+    header_element = next(element_iter, None)
+    if header_element is None or header_element.tag != "Header":
+        logger.error("Get Header FAILED")
+        return
+
+    log = Log.from_header_xml(header_element)
+    if not log:
+        logger.error("Get Log.from_header_xml FAILED")
+        return
+
+    # Logs without ActivityTypeName (activity_type_name "") go to gpx, as with openambit2gpx
+    if log.activity_type_name == "Aerobics":
+        logger.debug("convert_parsed_log_to_tcx")
+        x_file_path = f"{out_dir_path}/{log_file_basename}.tcx"
+        log.sample_list = Log.samples_from_xml(element_iter)
+        convert_parsed_log_to_tcx(log, x_file_path)
+    else:
+        logger.debug("convert_parsed_log_to_gpx")
+        x_file_path = f"{out_dir_path}/{log_file_basename}.gpx"
+        # Written aside and renamed once complete, as Tcx.Writer does, not to leave a truncated file
+        tmp_file_path = f"{x_file_path}.tmp"
+        try:
+            convert_parsed_log_to_gpx(header_element, element_iter, tmp_file_path, average_hr)
+        except BaseException:
+            if os.path.isfile(tmp_file_path):
+                os.remove(tmp_file_path)
+            raise
+        os.replace(tmp_file_path, x_file_path)
+
+    return x_file_path
+
+def convert_log_to_x_job(log_file_path: str, out_dir_path: str, average_hr: bool):
+    """convert_log_to_x for a worker process: errors are returned rather than raised
+
+    Return (output file path or None, error, log file hash)
+    """
+
+    logger = logging.getLogger("convert_log_to_x_job")
+
+    sha256 = ""
+    try:
+        sha256 = file_sha256(log_file_path)
+        x_file_path = convert_log_to_x(log_file_path, out_dir_path, average_hr)
+    except Exception as exc:
+        logger.debug("convert_log_to_x %s", log_file_path, exc_info=True)
+        return None, f"{type(exc).__name__}: {exc}", sha256
+
+    if not x_file_path:
+        return None, "convert_log_to_x FAILED", sha256
+
+    return x_file_path, "", sha256
+
+def convert_all_log_to_x(log_dir_path: str, out_dir_path: str = "", average_hr=True, jobs: int = 0, force=False):
+    """Convert all logs of a directory, in parallel in a pool of jobs processes (0: one per CPU)
+
+    Logs are skipped, unless force, if the manifest of the output dir tells
+    they have not changed since converted by the same converter. Failed logs
+    are not recorded, so that they are tried again next time.
+    Return the list of logs which failed.
+    """
+
+    logger = logging.getLogger("convert_all_log_to_x")
 
-        log = Log.from_xml(log_element)
-        if not log:
-            logger.error("Get Log.from_xml FAILED")
-            return
+    if not out_dir_path:
+        out_dir_path = log_dir_path
+    logger.debug("out_dir_path = %s", out_dir_path)
 
-        if log.activity_type_name == "Aerobics":
-            logger.debug("convert_log_to_tcx")
-            x_file_path = f"{out_dir_path}/{log_file_basename}.tcx"
-            return convert_log_to_tcx(log_file_path, x_file_path)
-        else:
-            logger.debug("convert_log_to_gpx")
-            x_file_path = f"{out_dir_path}/{log_file_basename}.gpx"
-            return convert_log_to_gpx(log_file_path, x_file_path, average_hr)
+    converter = converter_version(average_hr)
+    logger.debug("converter = %s", converter)
+    manifest = Manifest.load(out_dir_path)
+
+    # Key = log file path, value = stat before conversion
+    log_stat_dict = {}
+    skipped_count = 0
+    for log_file_path in sorted(glob.glob(os.path.join(log_dir_path, "*.log"))):
+        stat = os.stat(log_file_path)
+        if not force and manifest.is_up_to_date(log_file_path, stat, converter):
+            logger.debug("%s up to date, skip", log_file_path)
+            skipped_count += 1
+            continue
+        log_stat_dict[log_file_path] = stat
+
+    logger.info("%d logs to convert, %d up to date", len(log_stat_dict), skipped_count)
+
+    failed_list = []
+    byte_count = 0
+    start_time = time.monotonic()
+
+    try:
+        with ProcessPoolExecutor(max_workers=jobs or None) as executor:
+            future_dict = {
+                executor.submit(convert_log_to_x_job, log_file_path, out_dir_path, average_hr): log_file_path
+                for log_file_path in log_stat_dict}
+
+            for future in as_completed(future_dict):
+                log_file_path = future_dict[future]
+                try:
+                    x_file_path, error, sha256 = future.result()
+                except Exception as exc:
+                    # Worker process died
+                    x_file_path, error, sha256 = None, f"{type(exc).__name__}: {exc}", ""
+
+                if x_file_path:
+                    logger.info("%s -> %s", log_file_path, x_file_path)
+                    byte_count += log_stat_dict[log_file_path].st_size
+                else:
+                    logger.error("%s FAILED: %s", log_file_path, error)
+                    failed_list += [log_file_path]
+
+                if x_file_path and sha256:
+                    manifest.update(log_file_path, log_stat_dict[log_file_path], sha256, converter,
+                        os.path.abspath(x_file_path))
+                else:
+                    manifest.remove(log_file_path)
+    finally:
+        manifest.save()
+
+    duration = time.monotonic() - start_time
+    converted_count = len(log_stat_dict) - len(failed_list)
+    logger.info("%d converted, %d failed, %d skipped in %.1f s (%.1f logs/s, %.1f MB/s)",
+        converted_count, len(failed_list), skipped_count, duration,
+        converted_count / duration if duration else 0.0,
+        byte_count / 1000000 / duration if duration else 0.0)
+    for log_file_path in failed_list:
+        logger.error("FAILED: %s", log_file_path)
+
+    return failed_list
 
 def main():
     parser = ArgumentParser(prog="openambit2x", description="Convert Ambit log file to gpx or tcx")
-    parser.add_argument("log_path", help="Path to input log file")
-    parser.add_argument('-no-avg-hr', dest='no_avg_hr', action='store_false', default=False,
+    parser.add_argument("log_path", nargs="?", help="Path to input log file")
+    parser.add_argument("--all", metavar="LOG_DIR", default="",
+        help="Convert all logs of LOG_DIR changed since last converted, instead of log_path")
+    parser.add_argument("-j", "--jobs", type=int, default=0,
+        help="With --all, number of parallel conversions, default is one per CPU")
+    parser.add_argument("-f", "--force", action="store_true",
+        help="With --all, also convert logs up to date")
+    parser.add_argument('-no-avg-hr', dest='no_avg_hr', action='store_true', default=False,
         help='Do not average hr over 32 heart beats')
     parser.add_argument("-o", "--out", default="", help="Path to output dir")
     parser.add_argument("-v", "--verbose", action="store_true")
     args = parser.parse_args()
 
+    if bool(args.log_path) == bool(args.all):
+        parser.error("either log_path or --all is required")
+
     log_level = LOG_LEVEL_DEFAULT
     if args.verbose:
         log_level = LOG_LEVEL_VERBOSE
     logging.basicConfig(format=LOG_FMT, level=log_level)
 
-    convert_log_to_x(args.log_path, args.out, args.no_avg_hr)
+    if args.all:
+        failed_list = convert_all_log_to_x(args.all, args.out, not args.no_avg_hr, args.jobs, args.force)
+        if failed_list:
+            sys.exit(1)
+    else:
+        convert_log_to_x(args.log_path, args.out, not args.no_avg_hr)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,311 @@
+#!/usr/bin/python
+
+""" Convert logs to gpx or tcx and upload them to Strava, as a pipeline: each log
+is uploaded as soon as converted, while the next ones are converted.
+usage: ./strava_sync.py [-o OUT_DIR] [--fetch] LOG_PATH [LOG_PATH ...]
+"""
+
+from __future__ import annotations
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+import glob
+import logging
+import operator
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from typing import Callable, List
+
+from manifest import Manifest
+from openambit2x import convert_log_to_x_job, converter_version
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "stravauploader"))
+import strava_uploader
+
+LOG_LEVEL_DEFAULT = logging.INFO
+LOG_LEVEL_VERBOSE = logging.DEBUG
+LOG_FMT = "[%(levelname)5s][%(name)12s] %(message)s"
+
+OPENAMBIT_CLI_ARGS = ["--no-sync-sport-mode", "--no-sync-navigation", "--no-sync-orbit"]
+
+@dataclass
+class Stage():
+    """Threads applying function to the items of in_queue, results (unless None) going to out_queue
+
+    Items are logged, and recorded in failed_list, by their key (e.g. a file path).
+    Queues are bounded, so that a stage ahead of the next one waits for it
+    rather than piling up items (e.g. gzipped files in memory).
+    """
+
+    name: str
+    function: Callable
+    in_queue: queue.Queue
+    out_queue: queue.Queue | None
+    thread_count: int = 1
+    key: Callable = lambda item: item
+    failed_list: List = field(default_factory=list)
+    _thread_list: List[threading.Thread] = field(default_factory=list)
+
+    def start(self):
+        for _ in range(self.thread_count):
+            thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+            thread.start()
+            self._thread_list += [thread]
+
+    def run(self):
+
+        logger = logging.getLogger(f"Stage::{self.name}")
+
+        while True:
+            item = self.in_queue.get()
+            if item is None:
+                break
+            try:
+                result = self.function(item)
+            except Exception as exc:
+                logger.error("%s FAILED (%s: %s)", self.key(item), type(exc).__name__, exc)
+                result = None
+            if result is None:
+                self.failed_list += [self.key(item)]
+            elif self.out_queue is not None:
+                self.out_queue.put(result)
+
+    def join(self):
+        """Wait for all items of in_queue, once the previous stage is done"""
+        for _ in self._thread_list:
+            self.in_queue.put(None)
+        for thread in self._thread_list:
+            thread.join()
+
+@dataclass
+class StravaSync():
+    """Logs flowing through convert -> compress -> upload stages
+
+    Conversions run in a process pool, compression and uploads in threads,
+    as they wait on gzip and the network. Logs up to date in the manifest of
+    the output dir are not converted again, but still uploaded unless the
+    journal has their upload done (e.g. it failed last time), or all of them
+    if upload_all, the journal skipping those already uploaded. Logs which
+    failed to convert are not recorded: they are tried again, and reported
+    as failed, on each run until they convert.
+    """
+
+    out_dir_path: str
+    average_hr: bool = True
+    convert_jobs: int = 0
+    upload_jobs: int = strava_uploader.UPLOAD_JOBS
+    queue_size: int = 4
+    compress: bool = True
+    journal: strava_uploader.UploadJournal | None = None
+    force: bool = False
+    upload_all: bool = False
+
+    _manifest: Manifest = None
+    _manifest_lock: threading.Lock = field(default_factory=threading.Lock)
+    _converter: str = ""
+    _executor: ProcessPoolExecutor = None
+    _start_time: float = 0.0
+    _first_upload_time: float | None = None
+    _uploaded_list: List[str] = field(default_factory=list)
+
+    def convert(self, log_file_path: str):
+        """Convert a log in the process pool, return output file path, None on error"""
+
+        logger = logging.getLogger("StravaSync::convert")
+
+        stat = os.stat(log_file_path)
+        x_file_path, error, sha256 = self._executor.submit(convert_log_to_x_job,
+            log_file_path, self.out_dir_path, self.average_hr).result()
+
+        # Failures are not recorded, so that they are retried next time
+        with self._manifest_lock:
+            if x_file_path and sha256:
+                self._manifest.update(log_file_path, stat, sha256, self._converter, os.path.abspath(x_file_path))
+            else:
+                self._manifest.remove(log_file_path)
+
+        if not x_file_path:
+            logger.error("%s FAILED: %s", log_file_path, error)
+            return None
+
+        logger.info("%s -> %s", log_file_path, x_file_path)
+        return x_file_path
+
+    def open_upload_file(self, x_file_path: str):
+        """Gzip a converted file ahead of its upload, return (path, upload file or None if already uploaded)"""
+
+        if self.journal:
+            entry = self.journal.get(strava_uploader.fileSha256(x_file_path))
+            if entry and entry["status"] in ["done", "duplicate", "uploaded"]:
+                # Nothing to send, uploadMove skips or resumes it
+                return x_file_path, None
+
+        ext = x_file_path[-3:]
+        return x_file_path, strava_uploader.openUploadFile(x_file_path, ext, self.compress)
+
+    def upload(self, path_upload_file: tuple):
+        """Upload a converted file, return its path, None on error"""
+
+        x_file_path, upload_file = path_upload_file
+
+        if self._first_upload_time is None:
+            self._first_upload_time = time.monotonic()
+
+        status_code, status = strava_uploader.uploadMoveAuthorized(x_file_path, self.journal,
+            self.compress, upload_file)
+        if status_code != 200:
+            logging.getLogger("StravaSync::upload").error("%s FAILED: code %s, %s", x_file_path, status_code, status)
+            return None
+
+        self._uploaded_list += [x_file_path]
+        return x_file_path
+
+    def is_uploaded(self, x_file_path: str):
+        """Whether the journal has the upload of a converted file done"""
+        if not self.journal:
+            return False
+        entry = self.journal.get(strava_uploader.fileSha256(x_file_path))
+        return bool(entry) and entry["status"] in ["done", "duplicate"]
+
+    def run(self, log_file_path_list: List[str]):
+        """Convert and upload logs, return the list of those which failed"""
+
+        logger = logging.getLogger("StravaSync::run")
+
+        os.makedirs(self.out_dir_path, exist_ok=True)
+        self._converter = converter_version(self.average_hr)
+        self._manifest = Manifest.load(self.out_dir_path)
+
+        convert_queue = queue.Queue(self.queue_size)
+        compress_queue = queue.Queue(self.queue_size)
+        upload_queue = queue.Queue(self.queue_size)
+
+        self._start_time = time.monotonic()
+        strava_uploader.setPoolSize(self.upload_jobs)
+
+        skipped_count = 0
+
+        try:
+            convert_jobs = self.convert_jobs or os.cpu_count() or 1
+            with ProcessPoolExecutor(max_workers=convert_jobs) as executor:
+                self._executor = executor
+
+                # Enough threads to keep all worker processes busy
+                stage_list = [
+                    Stage("convert", self.convert, convert_queue, compress_queue, convert_jobs),
+                    Stage("compress", self.open_upload_file, compress_queue, upload_queue),
+                    Stage("upload", self.upload, upload_queue, None, self.upload_jobs, operator.itemgetter(0)),
+                ]
+                for stage in stage_list:
+                    stage.start()
+
+                for log_file_path in log_file_path_list:
+                    stat = os.stat(log_file_path)
+                    with self._manifest_lock:
+                        entry = self._manifest.entry_dict.get(os.path.abspath(log_file_path))
+                        up_to_date = not self.force and self._manifest.is_up_to_date(log_file_path, stat, self._converter)
+                    if up_to_date:
+                        # Converted, failed conversions are never up to date
+                        x_file_path = entry.x_file_path
+                        # Without journal, only upload_all tells to upload again
+                        if (self.upload_all
+                                or (self.journal and not self.is_uploaded(x_file_path))):
+                            compress_queue.put(x_file_path)
+                        else:
+                            logger.debug("%s up to date, skip", log_file_path)
+                            skipped_count += 1
+                        continue
+                    convert_queue.put(log_file_path)
+
+                # Each stage is done once the previous one is, and its queue is empty
+                for stage in stage_list:
+                    stage.join()
+        finally:
+            self._manifest.save()
+
+        failed_list = [item for stage in stage_list for item in stage.failed_list]
+
+        duration = time.monotonic() - self._start_time
+        logger.info("%d uploaded, %d failed, %d skipped in %.1f s (first upload after %.1f s)",
+            len(self._uploaded_list), len(failed_list), skipped_count, duration,
+            self._first_upload_time - self._start_time if self._first_upload_time is not None else 0.0)
+        for item in failed_list:
+            logger.error("FAILED: %s", item)
+
+        return failed_list
+
+def fetch_logs(openambit_cli: str, args: List[str]):
+    """Get new logs from the watch, return whether it succeeded"""
+
+    logger = logging.getLogger("fetch_logs")
+
+    logger.info("%s %s", openambit_cli, " ".join(OPENAMBIT_CLI_ARGS + args))
+    if subprocess.run([openambit_cli] + OPENAMBIT_CLI_ARGS + args).returncode != 0:
+        logger.error("%s FAILED", openambit_cli)
+        return False
+
+    return True
+
+def main():
+    parser = ArgumentParser(prog="strava_sync", description="Convert Ambit logs and upload them to Strava, as a pipeline")
+    parser.add_argument("log_path_list", nargs="+", metavar="LOG_PATH", help="Log files, or log dirs")
+    parser.add_argument("-o", "--out", default="gpx", help="Path to output dir of gpx and tcx files (default gpx)")
+    parser.add_argument("--fetch", action="store_true", help="Get new logs from the watch first, with openambit-cli")
+    parser.add_argument("--openambit-cli", default="openambit-cli", help="Path to openambit-cli (default openambit-cli)")
+    parser.add_argument("-j", "--jobs", type=int, default=0, help="Parallel conversions, default is one per CPU")
+    parser.add_argument("-u", "--upload-jobs", type=int, default=strava_uploader.UPLOAD_JOBS,
+        help=f"Uploads in flight (default {strava_uploader.UPLOAD_JOBS})")
+    parser.add_argument("-q", "--queue-size", type=int, default=4, help="Files waiting between stages (default 4)")
+    parser.add_argument("-f", "--force", action="store_true", help="Also convert logs up to date")
+    parser.add_argument("-a", "--upload-all", action="store_true",
+        help="Upload all logs converted before, not only those without a done upload in the journal (e.g. with no journal)")
+    parser.add_argument("-no-avg-hr", dest="no_avg_hr", action="store_true",
+        help="Do not average hr over 32 heart beats")
+    parser.add_argument("--journal", default=strava_uploader.JOURNAL_PATH,
+        help=f"Journal of uploads (default {strava_uploader.JOURNAL_PATH}), empty for none")
+    parser.add_argument("--no-gzip", dest="gzip", action="store_false", help="Upload files as they are, not gzipped")
+    parser.add_argument("--url", default=strava_uploader.STRAVA_URL,
+        help=f"Strava URL (default {strava_uploader.STRAVA_URL}), e.g. of a local stand-in server")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args, cli_args = parser.parse_known_args()
+
+    log_level = LOG_LEVEL_DEFAULT
+    if args.verbose:
+        log_level = LOG_LEVEL_VERBOSE
+    logging.basicConfig(format=LOG_FMT, level=log_level)
+
+    if cli_args and not args.fetch:
+        parser.error(f"unrecognized arguments: {' '.join(cli_args)}")
+
+    # Other arguments are for openambit-cli
+    if args.fetch and not fetch_logs(args.openambit_cli, cli_args):
+        sys.exit(1)
+
+    log_file_path_list = []
+    for log_path in args.log_path_list:
+        if os.path.isdir(log_path):
+            log_file_path_list += sorted(glob.glob(os.path.join(log_path, "*.log")))
+        else:
+            log_file_path_list += [log_path]
+
+    strava_uploader.STRAVA_URL = args.url.rstrip("/")
+    journal = strava_uploader.UploadJournal(args.journal) if args.journal else None
+
+    try:
+        strava_sync = StravaSync(args.out, not args.no_avg_hr, args.jobs, args.upload_jobs, args.queue_size,
+            args.gzip, journal, args.force, args.upload_all)
+        failed_list = strava_sync.run(log_file_path_list)
+    finally:
+        if journal:
+            journal.close()
+
+    if failed_list:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 #!/bin/sh
 
 #
-# Fetch logs from watch, convert them info .gpx and upload it to Strava
+# Fetch logs from watch, convert them into .gpx and upload them to Strava
 #
 
 ROOT=.
@@ -41,22 +41,8 @@ if [ $nb_new_logs -eq 0 ] ; then
     exit 0
 fi
 
-if [ ! -e ${ROOT}/gpx ] ; then
-    mkdir ${ROOT}gpx
-fi
-
-# Convert new logs to gpx format
+# Convert new logs to gpx (tcx for Aerobics) and upload each as soon as converted
 logs=`ls ~/.openambit/*.log|tail -n $nb_new_logs`
 
-logs_out=""
-for log in $logs ; do
-    log_out="${ROOT}/gpx/$(basename $log .log).gpx"
-    echo ${ROOT}/tools/openambit2gpx.py -out "$log_out" "$log"
-    ${ROOT}/tools/openambit2gpx.py -out "$log_out" "$log"
-    logs_out="$logs_out $log_out"
-done
-
-# Strava upload
-echo ${ROOT}/tools/stravauploader/strava_uploader.py -l $logs_out
-${ROOT}/tools/stravauploader/strava_uploader.py -l $logs_out
-
+echo ${ROOT}/tools/strava_sync.py -o ${ROOT}/gpx $logs
+${ROOT}/tools/strava_sync.py -o ${ROOT}/gpx $logs
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+'''
+Upload throughput and latency of strava_uploader.py against mock_strava.py,
+for a batch of generated GPX and TCX files.
+usage: ./benchmark_upload.py [-n COUNT] [--size KB] [--delay S] [--limits N,N] [--window S] [-j JOBS [JOBS ...]] [--no-gzip]
+'''
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import mock_strava
+import strava_uploader
+
+def writeGpx(path, points, start):
+    with open(path, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8" standalone="no" ?>\n\n')
+        f.write('<gpx xmlns="http://www.topografix.com/GPX/1/1" version="1.1" creator="benchmark_upload">\n <trk>\n  <trkseg>\n')
+        lat, lon = 47.0065078, 9.948604
+        for i in range(points):
+            lat += random.uniform(-0.00005, 0.00005)
+            lon += random.uniform(-0.00005, 0.00005)
+            f.write('   <trkpt lat="{:.7f}" lon="{:.7f}"><ele>{}</ele><time>{}Z</time>'
+                    '<extensions><gpxdata:hr>{}</gpxdata:hr></extensions></trkpt>\n'.format(
+                        lat, lon, 1000 + i % 50, (start + timedelta(seconds=i)).isoformat(), 120 + i % 40))
+        f.write('  </trkseg>\n </trk>\n</gpx>\n')
+
+def writeTcx(path, points, start):
+    with open(path, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<TrainingCenterDatabase '
+                'xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2">\n'
+                ' <Activities>\n  <Activity Sport="Running">\n   <Id>{}Z</Id>\n   <Lap StartTime="{}Z">\n    <Track>\n'.format(
+                    start.isoformat(), start.isoformat()))
+        for i in range(points):
+            f.write('     <Trackpoint><Time>{}Z</Time><DistanceMeters>{}</DistanceMeters>'
+                    '<AltitudeMeters>{}</AltitudeMeters></Trackpoint>\n'.format(
+                        (start + timedelta(seconds=i)).isoformat(), i * 3, 1000 + i % 50))
+        f.write('    </Track>\n   </Lap>\n  </Activity>\n </Activities>\n</TrainingCenterDatabase>\n')
+
+def generateFiles(dirPath, count, size):
+    '''count files of about size bytes, half GPX, half TCX, each a different move'''
+    paths = []
+    for i in range(count):
+        start = datetime(2024, 1, 1) + timedelta(days=i)
+        if i % 2:
+            path = os.path.join(dirPath, 'move{:04d}.tcx'.format(i))
+            writeTcx(path, max(size // 150, 1), start)
+        else:
+            path = os.path.join(dirPath, 'move{:04d}.gpx'.format(i))
+            writeGpx(path, max(size // 180, 1), start)
+        paths.append(path)
+    return paths
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)] if values else 0
+
+def run(paths, jobs, compress, delay, limits, window):
+    '''Upload paths to a new mock, return (seconds, latencies, mock stats, results)'''
+
+    mock = mock_strava.MockStrava(delay, limits, window)
+    server = mock_strava.serve(mock)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    strava_uploader.STRAVA_URL = 'http://127.0.0.1:{}'.format(server.server_port)
+    strava_uploader.rateLimit = strava_uploader.RateLimit(windows=[window, strava_uploader.RateLimit.WINDOWS[1]])
+
+    # Time of each upload, from post to activity
+    latencies = []
+    uploadMoveAuthorized = strava_uploader.uploadMoveAuthorized
+    def timedUploadMove(*args):
+        start = time.perf_counter()
+        result = uploadMoveAuthorized(*args)
+        latencies.append(time.perf_counter() - start)
+        return result
+    strava_uploader.uploadMoveAuthorized = timedUploadMove
+
+    try:
+        start = time.perf_counter()
+        results = strava_uploader.uploadMoves(paths, jobs, None, compress)
+        seconds = time.perf_counter() - start
+    finally:
+        strava_uploader.uploadMoveAuthorized = uploadMoveAuthorized
+        server.shutdown()
+        server.server_close()
+
+    return seconds, latencies, mock.stats, results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark strava_uploader.py against a local mock Strava')
+    parser.add_argument('-n', '--count', type=int, default=40, help='Files to upload (default 40)')
+    parser.add_argument('--size', type=int, default=500, help='Size of each file, kB (default 500)')
+    parser.add_argument('--delay', type=float, default=1.0, help='Seconds the mock takes to process an upload (default 1)')
+    # High enough by default not to wait for the next window, which would be most of the wall time
+    parser.add_argument('--limits', default='1000000,1000000',
+                        help='Requests per window and per day of the mock (default 1000000,1000000), e.g. 200,2000 as Strava')
+    parser.add_argument('--window', type=float, default=15*60, help='Rate limit window, seconds (default 900)')
+    parser.add_argument('-j', '--jobs', type=int, nargs='+', default=[1, 4, 8], help='Uploads in flight, one run each (default 1 4 8)')
+    parser.add_argument('--no-gzip', dest='gzip', action='store_false', help='Upload files as they are')
+    args = parser.parse_args()
+
+    random.seed(1)
+
+    with tempfile.TemporaryDirectory() as dirPath:
+        paths = generateFiles(dirPath, args.count, args.size * 1000)
+        totalBytes = sum(os.path.getsize(path) for path in paths)
+        print('{} files, {:.1f} MB, mock processing delay {} s, gzip {}'.format(
+            len(paths), totalBytes / 1e6, args.delay, 'on' if args.gzip else 'off'))
+        print('{:>5} {:>8} {:>9} {:>9} {:>10} {:>9} {:>9} {:>8}'.format(
+            'jobs', 'wall s', 'files/s', 'MB/s', 'sent MB', 'p50 s', 'p95 s', 'requests'))
+
+        # Quiet uploader prints
+        stdout = sys.stdout
+        for jobs in args.jobs:
+            sys.stdout = open(os.devnull, 'w')
+            try:
+                seconds, latencies, stats, results = run(paths, jobs, args.gzip, args.delay, [int(limit) for limit in args.limits.split(',')], args.window)
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+            failed = sum(1 for status_code, status in results.values() if status_code != 200)
+            print('{:>5} {:>8.2f} {:>9.2f} {:>9.2f} {:>10.2f} {:>9.2f} {:>9.2f} {:>8}{}'.format(
+                jobs, seconds, len(paths) / seconds, totalBytes / 1e6 / seconds, stats['bytes'] / 1e6,
+                percentile(latencies, 0.5), percentile(latencies, 0.95), stats['requests'],
+                ' ({} FAILED)'.format(failed) if failed else ''))
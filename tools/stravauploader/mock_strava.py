@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+'''
+Local stand-in for the parts of the Strava API used by strava_uploader.py,
+to run and benchmark it without the live service.
+usage: ./mock_strava.py [-p PORT] [--delay S] [--limits N,N] [--window S] [--expire-every N]
+then: ./strava_uploader.py --url http://localhost:PORT [--window S] -l LOGS
+'''
+
+import argparse
+import gzip
+import hashlib
+import itertools
+import json
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock
+from urllib.parse import parse_qs, urlsplit
+
+class MockStrava(object):
+    '''
+    State of the stand-in server
+
+    Uploads are processed after delay seconds, a file already uploaded (same
+    content) is rejected as duplicate once processed. API requests are counted
+    in windows of window seconds and daily, rejected with 429 beyond limits.
+    Every expireEvery uploads (0 for never), the access token changes and
+    requests with the previous one get 401, until a new one is got from
+    /oauth/token.
+    '''
+
+    def __init__(self, delay=2.0, limits=(200, 2000), window=15*60, expireEvery=0):
+        self.lock = Lock()
+        self.delay = delay
+        self.limits = list(limits)
+        self.windows = [window, 24*3600]
+        self.usage = [0, 0]
+        self.windowStarts = self.getWindowStarts(time.time())
+        self.expireEvery = expireEvery
+        # None accepts any token, until the first expiry
+        self.token = None
+        self.tokenCount = itertools.count(1)
+        self.uploadIds = itertools.count(1)
+        # Key = upload id, value = dict of the upload
+        self.uploads = {}
+        # Key = file content sha256, value = activity id
+        self.activities = {}
+        self.stats = {'requests': 0, 'uploads': 0, 'polls': 0, '401': 0, '429': 0, 'bytes': 0}
+
+    def getWindowStarts(self, now):
+        return [now - now % window for window in self.windows]
+
+    def countRequest(self):
+        '''Count an API request, return whether within limits'''
+        with self.lock:
+            self.stats['requests'] += 1
+            windowStarts = self.getWindowStarts(time.time())
+            for i in range(len(self.windows)):
+                if windowStarts[i] != self.windowStarts[i]:
+                    self.usage[i] = 0
+            self.windowStarts = windowStarts
+            if any(self.usage[i] >= self.limits[i] for i in range(len(self.windows))):
+                self.stats['429'] += 1
+                return False
+            for i in range(len(self.windows)):
+                self.usage[i] += 1
+            return True
+
+    def rateLimitHeaders(self):
+        with self.lock:
+            return {'X-RateLimit-Limit': ','.join(str(limit) for limit in self.limits),
+                    'X-RateLimit-Usage': ','.join(str(usage) for usage in self.usage)}
+
+    def authorized(self, authorization):
+        with self.lock:
+            if self.token is None or authorization == 'Bearer ' + self.token:
+                return True
+            self.stats['401'] += 1
+            return False
+
+    def newToken(self):
+        with self.lock:
+            if self.token is None:
+                self.token = 'mock-token-{}'.format(next(self.tokenCount))
+            return self.token
+
+    def addUpload(self, content):
+        with self.lock:
+            uploadId = next(self.uploadIds)
+            self.stats['uploads'] += 1
+            if self.expireEvery and self.stats['uploads'] % self.expireEvery == 0:
+                self.token = 'mock-token-{}'.format(next(self.tokenCount))
+            self.uploads[uploadId] = {'id': uploadId, 'ready': time.time() + self.delay, 'error': None,
+                                      'sha256': hashlib.sha256(content).hexdigest()}
+            return uploadId
+
+    def getUpload(self, uploadId):
+        '''Upload response, None if unknown'''
+        with self.lock:
+            self.stats['polls'] += 1
+            upload = self.uploads.get(uploadId)
+            if upload is None:
+                return None
+            resp = {'id': uploadId, 'activity_id': None, 'error': None, 'status': 'Your activity is still being processed.'}
+            if time.time() < upload['ready']:
+                return resp
+            if 'activity_id' not in upload:
+                if upload['sha256'] in self.activities:
+                    upload['error'] = 'duplicate of activity {}'.format(self.activities[upload['sha256']])
+                    upload['activity_id'] = None
+                else:
+                    upload['activity_id'] = 1000000 + uploadId
+                    self.activities[upload['sha256']] = upload['activity_id']
+            if upload['error']:
+                resp.update(error=upload['error'], status='There was an error processing your activity.')
+            else:
+                resp.update(activity_id=upload['activity_id'], status='Your activity is ready.')
+            return resp
+
+class MockStravaHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def sendJson(self, code, obj, headers={}):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def readBody(self):
+        size = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(size)
+        with self.server.mock.lock:
+            self.server.mock.stats['bytes'] += size
+        return body
+
+    def checkApi(self):
+        '''Rate limits and authorization of an API request, False if already answered'''
+        mock = self.server.mock
+        if not mock.countRequest():
+            self.sendJson(429, {'message': 'Rate Limit Exceeded'}, mock.rateLimitHeaders())
+            return False
+        if not mock.authorized(self.headers.get('Authorization')):
+            self.sendJson(401, {'message': 'Authorization Error'}, mock.rateLimitHeaders())
+            return False
+        return True
+
+    def do_GET(self):
+        mock = self.server.mock
+        url = urlsplit(self.path)
+
+        if url.path == '/oauth/authorize':
+            # Accepted at once, back to the uploader with a code
+            query = parse_qs(url.query)
+            self.send_response(302)
+            self.send_header('Location', '{}?code=mock&scope=read,activity:write'.format(query['redirect_uri'][0]))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        match = re.fullmatch(r'/api/v3/uploads/(\d+)', url.path)
+        if not match:
+            self.sendJson(404, {'message': 'Record Not Found'})
+            return
+        if not self.checkApi():
+            return
+        resp = mock.getUpload(int(match.group(1)))
+        if resp is None:
+            self.sendJson(404, {'message': 'Record Not Found'}, mock.rateLimitHeaders())
+        else:
+            self.sendJson(200, resp, mock.rateLimitHeaders())
+
+    def do_POST(self):
+        mock = self.server.mock
+        url = urlsplit(self.path)
+        body = self.readBody()
+
+        if url.path == '/oauth/token':
+            self.sendJson(200, {'access_token': mock.newToken(), 'token_type': 'Bearer'})
+            return
+
+        if url.path != '/api/v3/uploads':
+            self.sendJson(404, {'message': 'Record Not Found'})
+            return
+        if not self.checkApi():
+            return
+
+        dataType = parse_qs(url.query).get('data_type', [''])[0]
+        match = re.search(r'boundary=([^;]+)', self.headers.get('Content-Type', ''))
+        content = None
+        if match:
+            for part in body.split(b'--' + match.group(1).encode('utf-8')):
+                head, sep, data = part.partition(b'\r\n\r\n')
+                if sep and b'name="file"' in head:
+                    content = data[:-len(b'\r\n')]
+        if content is None or dataType not in ['fit', 'tcx', 'gpx', 'fit.gz', 'tcx.gz', 'gpx.gz']:
+            self.sendJson(400, {'message': 'Bad Request', 'status': 'Invalid file or data_type'}, mock.rateLimitHeaders())
+            return
+        if dataType.endswith('.gz'):
+            try:
+                content = gzip.decompress(content)
+            except OSError:
+                self.sendJson(400, {'message': 'Bad Request', 'status': 'Invalid gzip file'}, mock.rateLimitHeaders())
+                return
+
+        uploadId = mock.addUpload(content)
+        self.sendJson(201, {'id': uploadId, 'activity_id': None, 'error': None,
+                            'status': 'Your activity is still being processed.'}, mock.rateLimitHeaders())
+
+def serve(mock, port=0):
+    '''Start serving mock on localhost port (any free one if 0), return the server, to call serve_forever() on'''
+    server = ThreadingHTTPServer(('127.0.0.1', port), MockStravaHandler)
+    server.daemon_threads = True
+    server.mock = mock
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for the Strava upload API')
+    parser.add_argument('-p', '--port', type=int, default=8983, help='Port (default 8983)')
+    parser.add_argument('--delay', type=float, default=2.0, help='Seconds to process an upload (default 2)')
+    parser.add_argument('--limits', default='200,2000', help='Requests per window and per day (default 200,2000)')
+    parser.add_argument('--window', type=float, default=15*60,
+                        help='Rate limit window, seconds (default 900), give strava_uploader.py the same --window')
+    parser.add_argument('--expire-every', type=int, default=0,
+                        help='Change access token every N uploads, 401 until a new one is got (default never)')
+    args = parser.parse_args()
+
+    mock = MockStrava(args.delay, [int(limit) for limit in args.limits.split(',')], args.window, args.expire_every)
+    server = serve(mock, args.port)
+    print('Mock Strava at http://localhost:{}'.format(server.server_port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(mock.stats)
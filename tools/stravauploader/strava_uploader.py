@@ -1,12 +1,22 @@
 #!/usr/bin/env python3
 
 import requests
+from requests.adapters import HTTPAdapter
 import argparse
+import gzip
+import hashlib
+import io
+import os
+import shutil
+import sqlite3
 import time
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from http.server import *
-from threading import Thread
+from tempfile import SpooledTemporaryFile
+from threading import Lock, Thread
+import uuid
 
 try:
     import config
@@ -20,6 +30,149 @@ except:
 
 HTTP_PORT=8982
 
+# Overridden with --url, e.g. for a local stand-in server
+STRAVA_URL='https://www.strava.com'
+JOURNAL_PATH=os.path.join(os.path.expanduser('~'), '.openambit', 'strava_uploads.sqlite')
+
+# Uploads in flight
+UPLOAD_JOBS=4
+# Seconds between status polls of an upload, doubled up to POLL_DELAY_MAX while processing
+POLL_DELAY=1
+POLL_DELAY_MAX=30
+# Bytes of a gzipped file kept in memory, more is spooled to disk
+GZIP_SPOOL_MAX=16*1024*1024
+
+class RateLimit(object):
+    '''
+    Strava API 15 minutes and daily rate limits, shared by all threads
+
+    Limits and usage are read from X-RateLimit-Limit and X-RateLimit-Usage
+    response headers ("15 minutes,daily"), and counted locally in between.
+    Windows reset at 0, 15, 30 and 45 minutes past the hour, and at midnight UTC.
+    Strava does not send their length: windows other than WINDOWS are only
+    for a local stand-in server, e.g. mock_strava.py --window.
+    '''
+
+    WINDOWS = [15*60, 24*3600]
+
+    def __init__(self, limits=(200, 2000), windows=WINDOWS):
+        self.lock = Lock()
+        self.limits = list(limits)
+        self.windows = list(windows)
+        self.usage = [0, 0]
+        self.windowStarts = self.getWindowStarts(time.time())
+
+    def getWindowStarts(self, now):
+        return [now - now % window for window in self.windows]
+
+    def wait(self):
+        '''Block until a request is allowed, and count it'''
+        while True:
+            with self.lock:
+                now = time.time()
+                windowStarts = self.getWindowStarts(now)
+                for i in range(len(self.windows)):
+                    if windowStarts[i] != self.windowStarts[i]:
+                        self.usage[i] = 0
+                self.windowStarts = windowStarts
+
+                delay = 0
+                for i in range(len(self.windows)):
+                    if self.usage[i] >= self.limits[i]:
+                        delay = max(delay, windowStarts[i] + self.windows[i] - now)
+                if not delay:
+                    for i in range(len(self.windows)):
+                        self.usage[i] += 1
+                    return
+
+            print('Rate limit reached ({} / {}), wait {:.0f} s'.format(self.usage, self.limits, delay))
+            time.sleep(delay)
+
+    def update(self, r):
+        '''Read limits and usage from the headers of response r'''
+        try:
+            limits = [int(x) for x in r.headers['X-RateLimit-Limit'].split(',')][:len(self.windows)]
+            usage = [int(x) for x in r.headers['X-RateLimit-Usage'].split(',')][:len(self.windows)]
+        except (KeyError, ValueError):
+            limits = []
+            usage = []
+        with self.lock:
+            self.limits[:len(limits)] = limits
+            self.usage[:len(usage)] = usage
+            if r.status_code == 429:
+                # Exceeded anyway, e.g. by another client
+                self.usage[0] = max(self.usage[0], self.limits[0])
+
+rateLimit = RateLimit()
+
+# Shared by all threads, so that connections are kept alive and reused
+session = requests.Session()
+
+def setPoolSize(size):
+    '''Keep up to size connections, one per thread'''
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+def stravaRequest(method, url, **kwargs):
+    '''Send a request within rate limits, again once the window is over if rejected by them (429)'''
+    while True:
+        rateLimit.wait()
+        body = kwargs.get('data')
+        if hasattr(body, 'seek'):
+            body.seek(0)
+        r = session.request(method, url, **kwargs)
+        rateLimit.update(r)
+        if r.status_code != 429:
+            return r
+
+class MultipartBody(object):
+    '''
+    multipart/form-data body of a file, read from it by chunks as sent,
+    instead of being built in memory. len gives its Content-Length.
+    '''
+
+    def __init__(self, name, fileName, f, size):
+        self.boundary = uuid.uuid4().hex
+        self.contentType = 'multipart/form-data; boundary={}'.format(self.boundary)
+        head = ('--{}\r\nContent-Disposition: form-data; name="{}"; filename="{}"\r\n'
+                'Content-Type: application/octet-stream\r\n\r\n').format(self.boundary, name, fileName).encode('utf-8')
+        tail = '\r\n--{}--\r\n'.format(self.boundary).encode('utf-8')
+        self.parts = [io.BytesIO(head), f, io.BytesIO(tail)]
+        self.len = len(head) + size + len(tail)
+        self.seek(0)
+
+    def seek(self, offset):
+        '''Back to the start (offset 0 only), e.g. to send again'''
+        for part in self.parts:
+            part.seek(0)
+        self.part = 0
+
+    def read(self, size=-1):
+        data = b''
+        while self.part < len(self.parts) and (size < 0 or len(data) < size):
+            chunk = self.parts[self.part].read(size - len(data) if size >= 0 else -1)
+            if not chunk:
+                self.part += 1
+            data += chunk
+        return data
+
+def openUploadFile(activity, ext, compress):
+    '''
+    Open a file to upload, gzipped on the fly (into memory, or a temporary file
+    if big) if compress and not already. Return (file, size, file name, data type)
+    '''
+    f = open(activity, 'rb')
+    if not compress or ext.endswith('.gz'):
+        return (f, os.fstat(f.fileno()).st_size, os.path.basename(activity), ext)
+
+    spool = SpooledTemporaryFile(max_size=GZIP_SPOOL_MAX)
+    with f, gzip.GzipFile(fileobj=spool, mode='wb', mtime=0) as gz:
+        shutil.copyfileobj(f, gz)
+    size = spool.tell()
+    spool.seek(0)
+    return (spool, size, os.path.basename(activity) + '.gz', ext + '.gz')
+
 class StopServer(Thread):
 
     def __init__(self, server):
@@ -51,8 +204,8 @@ class RequestHandler(SimpleHTTPRequestHandler):
                   'client_secret': config.CLIENT_SECRET,
                   'code':args['code'],
                   'grant_type':'authorization_code'}
-        url='https://www.strava.com/oauth/token'
-        r = requests.post(url, headers=headers, params=params)
+        url=STRAVA_URL + '/oauth/token'
+        r = session.post(url, headers=headers, params=params)
         json_vals = r.json()
         # print(json_vals)
 
@@ -64,74 +217,199 @@ class RequestHandler(SimpleHTTPRequestHandler):
         stop = StopServer(self.server)
         stop.start()
         
-def uploadMove(activity):
-    url = 'https://www.strava.com/api/v3/uploads'
-    ext = activity[-3:]
-    if not ext in ['fit', 'tcx', 'gpx']:
-        ext = activity[-6:]
-        if not ext in ['fit.gz', 'tcx.gz', 'gpx.gz']:
-            return (-1, 'Invalid file {}, must be one with extension fit[.gz], tcx[.gz] or gpx[.gz]'.format(activity))
-        
-    payload = {'data_type': ext}
+class UploadJournal(object):
+    '''
+    Uploads of files, by content hash, in a SQLite database, so that a run goes on
+    where the previous one stopped: done files (or duplicates) are skipped, uploads
+    still processing are polled again, failed ones are sent again.
+
+    status is uploaded (processing), done, duplicate or failed
+    '''
 
-    print('Process {}'.format(activity))
+    def __init__(self, path):
+        self.lock = Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('CREATE TABLE IF NOT EXISTS upload (sha256 TEXT PRIMARY KEY, path TEXT, upload_id INTEGER, status TEXT, activity_id INTEGER, error TEXT, updated TEXT)')
+        self.db.commit()
 
-    files = {'file': open(activity, 'rb')}
-    headers = {'Authorization': 'Bearer '+config.ACCESS_TOKEN}
-    r = requests.post(url, headers=headers, params=payload, files=files)
-    # print(r.json())
-    # print(r.status_code)
+    def get(self, sha256):
+        with self.lock:
+            return self.db.execute('SELECT * FROM upload WHERE sha256 = ?', (sha256,)).fetchone()
 
-    resp = r.json()
+    def record(self, sha256, path, status, upload_id=None, activity_id=None, error=None):
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO upload VALUES (?, ?, ?, ?, ?, ?, ?)',
+                            (sha256, path, upload_id, status, activity_id, error, datetime.now().isoformat(timespec='seconds')))
+            self.db.commit()
 
-    if (r.status_code == 401):
-        return (r.status_code, resp['message'])
-    if (r.status_code != 201 and r.status_code != 200):
-        print(r.json())
-        print(r.status_code)
-        return (r.status_code, resp['status'])
+    def close(self):
+        self.db.close()
 
-    while resp['activity_id'] == None:
-        time.sleep(1)
-        activty_url = url + '/' + str(resp['id'])
-        r = requests.get(activty_url, headers=headers)
+def fileSha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024*1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def pollUpload(uploadId, headers):
+    '''Wait for an upload to be processed, return (status code, upload response)'''
+    # Strava takes a few seconds to process an upload, poll less and less often
+    delay = POLL_DELAY
+    while True:
+        activty_url = STRAVA_URL + '/api/v3/uploads/' + str(uploadId)
+        r = stravaRequest('get', activty_url, headers=headers)
         resp = r.json()
+        if r.status_code != 200 or resp.get('error', '') or resp.get('activity_id') != None:
+            return (r.status_code, resp)
+        time.sleep(delay)
+        delay = min(delay * 2, POLL_DELAY_MAX)
+
+def uploadMove(activity, token, journal=None, compress=True, uploadFile=None):
+    '''
+    Upload activity, uploadFile being what openUploadFile returns for it if
+    already opened (e.g. gzipped ahead by a pipeline stage), closed once sent or on error.
+    '''
+    try:
+        ext = activity[-3:]
+        if not ext in ['fit', 'tcx', 'gpx']:
+            ext = activity[-6:]
+            if not ext in ['fit.gz', 'tcx.gz', 'gpx.gz']:
+                return (-1, 'Invalid file {}, must be one with extension fit[.gz], tcx[.gz] or gpx[.gz]'.format(activity))
+
+        headers = {'Authorization': 'Bearer '+token}
+
+        sha256 = fileSha256(activity) if journal else None
+        entry = journal.get(sha256) if journal else None
+
+        if entry and entry['status'] in ['done', 'duplicate']:
+            print('Skip {}, {} as activity {}'.format(activity, entry['status'], entry['activity_id']))
+            return (200, 'OK ({})'.format(entry['status']))
+
+        if entry and entry['status'] == 'uploaded':
+            print('Resume {}'.format(activity))
+            uploadId = entry['upload_id']
+        else:
+            print('Process {}'.format(activity))
+
+            (f, size, fileName, dataType) = uploadFile or openUploadFile(activity, ext, compress)
+            with f:
+                body = MultipartBody('file', fileName, f, size)
+                r = stravaRequest('post', STRAVA_URL + '/api/v3/uploads', params={'data_type': dataType}, data=body,
+                                  headers=dict(headers, **{'Content-Type': body.contentType}))
+            # print(r.json())
+            # print(r.status_code)
+
+            resp = r.json()
+
+            if (r.status_code == 401):
+                return (r.status_code, resp['message'])
+            if (r.status_code != 201 and r.status_code != 200):
+                print(r.json())
+                print(r.status_code)
+                if journal:
+                    journal.record(sha256, activity, 'failed', error=str(resp.get('status')))
+                return (r.status_code, resp['status'])
+
+            uploadId = resp['id']
+            if journal:
+                journal.record(sha256, activity, 'uploaded', upload_id=uploadId)
+
+        (status_code, resp) = pollUpload(uploadId, headers)
+
+        if status_code == 401:
+            # Still uploaded, polled again once authorized
+            return (status_code, resp['message'])
 
         if resp.get('error', ''):
             print(resp['error'])
-            return (r.status_code, resp['error'])
-        
-    if r.status_code == 200:
-        print('New activity at https://www.strava.com/activities/{}'.format(resp['activity_id']))
-        return (r.status_code, 'OK')
-    else:
-        return (r.status_code, resp['message'])
-
-def uploadMoves(activities):
-    i = 0
-    for activity in activities:
-        (status_code, status) = uploadMove(activity)
-        if status_code != 201:
-            now = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
-            if status_code == 200:
-                print('Strava code {}, status {}'.format(status_code, status))
-            elif status_code == 401:
-                print('Go to https://www.strava.com/oauth/authorize?client_id={}&redirect_uri=http://localhost:{}&response_type=code&approval_prompt=auto&scope=activity:write'.format(config.CLIENT_ID, HTTP_PORT))
-                httpd = HTTPServer(('127.0.0.1', HTTP_PORT), RequestHandler)
-                httpd.serve_forever()
-                # Try again
-                uploadMove(activity)
-            else:
-                print('error at {}, code {}, status {}'.format(now, status_code, status))
-
-        i += 1
-        if i == 100:  # 100 files per 15 mins rate limit
-            print('Limit rate raised, exit')
-            break
-
-parser = argparse.ArgumentParser()
-parser.add_argument("-l", "--logs", nargs="+", help="Logs to upload",
-                    dest="logs", required=True)
-args = parser.parse_args()
-
-uploadMoves(args.logs)
+            if journal:
+                status = 'duplicate' if 'duplicate' in resp['error'] else 'failed'
+                journal.record(sha256, activity, status, upload_id=uploadId, error=resp['error'])
+            return (status_code, resp['error'])
+
+        if status_code == 200:
+            print('New activity at https://www.strava.com/activities/{}'.format(resp['activity_id']))
+            if journal:
+                journal.record(sha256, activity, 'done', upload_id=uploadId, activity_id=resp['activity_id'])
+            return (status_code, 'OK')
+        else:
+            if journal:
+                journal.record(sha256, activity, 'failed', upload_id=uploadId, error=str(resp.get('message')))
+            return (status_code, resp.get('message'))
+    finally:
+        # Already closed if sent
+        if uploadFile:
+            uploadFile[0].close()
+
+authLock = Lock()
+
+def authorize(token):
+    '''Get a new access token in place of token, rejected, unless another thread already did'''
+    with authLock:
+        if config.ACCESS_TOKEN != token:
+            return
+        print('Go to {}/oauth/authorize?client_id={}&redirect_uri=http://localhost:{}&response_type=code&approval_prompt=auto&scope=activity:write'.format(STRAVA_URL, config.CLIENT_ID, HTTP_PORT))
+        httpd = HTTPServer(('127.0.0.1', HTTP_PORT), RequestHandler)
+        httpd.serve_forever()
+
+def uploadMoveAuthorized(activity, journal=None, compress=True, uploadFile=None):
+    token = config.ACCESS_TOKEN
+    (status_code, status) = uploadMove(activity, token, journal, compress, uploadFile)
+    if status_code == 401:
+        authorize(token)
+        # Try again
+        (status_code, status) = uploadMove(activity, config.ACCESS_TOKEN, journal, compress)
+    return (status_code, status)
+
+def uploadMoves(activities, jobs=UPLOAD_JOBS, journal=None, compress=True):
+    '''
+    Upload activities, jobs at a time, as fast as rate limits allow, skipping those done according to journal.
+    fit, gpx and tcx files are gzipped on the fly if compress.
+    '''
+    results = {}
+    setPoolSize(jobs)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(uploadMoveAuthorized, activity, journal, compress): activity for activity in activities}
+        for future in as_completed(futures):
+            activity = futures[future]
+            try:
+                (status_code, status) = future.result()
+            except Exception as e:
+                (status_code, status) = (-1, repr(e))
+            results[activity] = (status_code, status)
+            if status_code != 201:
+                now = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+                if status_code == 200:
+                    print('Strava code {}, status {}'.format(status_code, status))
+                else:
+                    print('error at {}, code {}, status {} ({})'.format(now, status_code, status, activity))
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-l", "--logs", nargs="+", help="Logs to upload",
+                        dest="logs", required=True)
+    parser.add_argument("-j", "--jobs", type=int, default=UPLOAD_JOBS,
+                        help="Uploads in flight (default {})".format(UPLOAD_JOBS))
+    parser.add_argument("--journal", default=JOURNAL_PATH,
+                        help="Journal of uploads, for reruns to skip or resume them (default {}), empty for none".format(JOURNAL_PATH))
+    parser.add_argument("--no-gzip", dest="gzip", action="store_false",
+                        help="Upload files as they are, not gzipped")
+    parser.add_argument("--url", default=STRAVA_URL,
+                        help="Strava URL (default {}), e.g. of a local stand-in server".format(STRAVA_URL))
+    parser.add_argument("--window", type=float, default=RateLimit.WINDOWS[0],
+                        help="Rate limit window, seconds (default {}), only for a local stand-in server".format(RateLimit.WINDOWS[0]))
+    args = parser.parse_args()
+
+    STRAVA_URL = args.url.rstrip('/')
+    rateLimit = RateLimit(windows=[args.window, RateLimit.WINDOWS[1]])
+
+    journal = UploadJournal(args.journal) if args.journal else None
+    try:
+        uploadMoves(args.logs, args.jobs, journal, args.gzip)
+    finally:
+        if journal:
+            journal.close()
@@ -1,50 +1,60 @@
 
 from __future__ import annotations
 
+from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
 from datetime import datetime
-import textwrap
-from typing import List
+import io
+import os
+from typing import List, TextIO
 
 DATETIME_NONE = datetime(1, 1, 1)
 
-def format_txt(txt: str):
-    txt = textwrap.dedent(txt.removeprefix("\n"))
-    while txt.endswith(" "):
-        txt.removesuffix(" ")
-    return txt
+INDENT = "    "
+
+class XmlElement(ABC):
+    """Element written to a stream in a single pass, indented according to its depth"""
+
+    @abstractmethod
+    def write(self, stream: TextIO, depth: int = 0):
+        pass
+
+    def to_xml(self):
+        stream = io.StringIO()
+        self.write(stream)
+        return stream.getvalue()
 
 @dataclass
-class Tcx():
+class Tcx(XmlElement):
 
     # 2011-07-10T09:52:40Z
     DATETIME_FMT = "%Y-%m-%dT%H:%M:%SZ"
 
     @dataclass
-    class Activity():
+    class Activity(XmlElement):
 
         @dataclass
-        class Lap():
+        class Lap(XmlElement):
 
             @dataclass
-            class Track():
+            class Track(XmlElement):
 
                 @dataclass
-                class Trackpoint():
+                class Trackpoint(XmlElement):
 
                     @dataclass
-                    class Position():
+                    class Position(XmlElement):
 
                         lat: float
                         long: float
 
-                        def to_xml(self):
-                            return format_txt(f"""
-                                <Position>
-                                    <LatitudeDegrees>{self.lat}</LatitudeDegrees>
-                                    <LongitudeDegrees>{self.long}</LongitudeDegrees>
-                                </Position>
-                                """)
+                        def write(self, stream: TextIO, depth: int = 0):
+                            indent = INDENT * depth
+                            stream.write(
+                                f"{indent}<Position>\n"
+                                f"{indent}    <LatitudeDegrees>{self.lat}</LatitudeDegrees>\n"
+                                f"{indent}    <LongitudeDegrees>{self.long}</LongitudeDegrees>\n"
+                                f"{indent}</Position>\n")
 
                     time: datetime
                     distance: float = 0.0
@@ -53,59 +63,48 @@ class Tcx():
                     heart_rate: int | None = None
                     cadence: int | None = None
 
-                    def to_xml(self):
+                    def write(self, stream: TextIO, depth: int = 0):
 
-                        ret = format_txt(f"""
-                            <Trackpoint>
-                                <Time>{self.time.strftime(Tcx.DATETIME_FMT)}</Time>
-                                <DistanceMeters>{self.distance}</DistanceMeters>
-                            """)
+                        indent = INDENT * depth
+
+                        stream.write(
+                            f"{indent}<Trackpoint>\n"
+                            f"{indent}    <Time>{self.time.strftime(Tcx.DATETIME_FMT)}</Time>\n"
+                            f"{indent}    <DistanceMeters>{self.distance}</DistanceMeters>\n")
 
                         if self.altitude is not None:
-                            ret += textwrap.indent(format_txt(f"""
-                                    <AltitudeMeters>{self.altitude}</AltitudeMeters>
-                                """), "    ")
+                            stream.write(f"{indent}    <AltitudeMeters>{self.altitude}</AltitudeMeters>\n")
 
                         if self.position:
-                            ret += textwrap.indent(self.position.to_xml(), "    ")
+                            self.position.write(stream, depth + 1)
 
                         if self.heart_rate is not None:
-                            ret += textwrap.indent(format_txt(f"""
-                                <HeartRateBpm xsi:type="HeartRateInBeatsPerMinute_t">
-                                    <Value>{self.heart_rate}</Value>
-                                </HeartRateBpm>
-                            """), "    ")
+                            stream.write(
+                                f'{indent}    <HeartRateBpm xsi:type="HeartRateInBeatsPerMinute_t">\n'
+                                f"{indent}        <Value>{self.heart_rate}</Value>\n"
+                                f"{indent}    </HeartRateBpm>\n")
 
                         if self.cadence is not None:
-                            ret += textwrap.indent(format_txt(f"""
-                                <Extensions>
-                                    <TPX xmlns="http://www.garmin.com/xmlschemas/ActivityExtension/v2" CadenceSensor="">
-                                        <RunCadence>{self.cadence}</RunCadence>
-                                    </TPX>
-                                </Extensions>
-                                """), "    ")
-
-                        ret += format_txt(f"""
-                            </Trackpoint>
-                            """)
+                            stream.write(
+                                f"{indent}    <Extensions>\n"
+                                f'{indent}        <TPX xmlns="http://www.garmin.com/xmlschemas/ActivityExtension/v2" CadenceSensor="">\n'
+                                f"{indent}            <RunCadence>{self.cadence}</RunCadence>\n"
+                                f"{indent}        </TPX>\n"
+                                f"{indent}    </Extensions>\n")
 
-                        return ret
+                        stream.write(f"{indent}</Trackpoint>\n")
 
                 trackpoint_list: List[Tcx.Activity.Lap.Track.Trackpoint] = field(default_factory=list)
 
                 def add_trackpoint(self, trackpoint: Tcx.Activity.Lap.Track.Trackpoint):
                     self.trackpoint_list += [trackpoint]
 
-                def to_xml(self):
-                    ret = format_txt(f"""
-                        <Track>
-                        """)
+                def write(self, stream: TextIO, depth: int = 0):
+                    indent = INDENT * depth
+                    stream.write(f"{indent}<Track>\n")
                     for trackpoint in self.trackpoint_list:
-                        ret += textwrap.indent(trackpoint.to_xml(), "    ")
-                    ret += format_txt(f"""
-                        </Track>
-                        """)
-                    return ret
+                        trackpoint.write(stream, depth + 1)
+                    stream.write(f"{indent}</Track>\n")
 
             start_time: datetime = DATETIME_NONE
             total_time: float = 0.0
@@ -146,28 +145,25 @@ class Tcx():
                     if len(heart_rate_list) > 0:
                         self.avg_heart_rate = int(self.max_heart_rate / len(heart_rate_list))
 
-            def to_xml(self):
-                ret = format_txt(f"""
-                    <Lap StartTime="{self.start_time.strftime(Tcx.DATETIME_FMT)}">
-                        <TotalTimeSeconds>{self.total_time}</TotalTimeSeconds>
-                        <DistanceMeters>{self.distance}</DistanceMeters>
-                        <MaximumSpeed>{self.max_speed}</MaximumSpeed>
-                        <Calories>{self.calories}</Calories>
-                        <AverageHeartRateBpm xsi:type="HeartRateInBeatsPerMinute_t">
-                            <Value>{self.avg_heart_rate}</Value>
-                        </AverageHeartRateBpm>
-                        <MaximumHeartRateBpm xsi:type="HeartRateInBeatsPerMinute_t">
-                            <Value>{self.max_heart_rate}</Value>
-                        </MaximumHeartRateBpm>
-                        <Intensity>{self.intensity}</Intensity>
-                        <TriggerMethod>{self.trigger_method}</TriggerMethod>
-                    """)
+            def write(self, stream: TextIO, depth: int = 0):
+                indent = INDENT * depth
+                stream.write(
+                    f'{indent}<Lap StartTime="{self.start_time.strftime(Tcx.DATETIME_FMT)}">\n'
+                    f"{indent}    <TotalTimeSeconds>{self.total_time}</TotalTimeSeconds>\n"
+                    f"{indent}    <DistanceMeters>{self.distance}</DistanceMeters>\n"
+                    f"{indent}    <MaximumSpeed>{self.max_speed}</MaximumSpeed>\n"
+                    f"{indent}    <Calories>{self.calories}</Calories>\n"
+                    f'{indent}    <AverageHeartRateBpm xsi:type="HeartRateInBeatsPerMinute_t">\n'
+                    f"{indent}        <Value>{self.avg_heart_rate}</Value>\n"
+                    f"{indent}    </AverageHeartRateBpm>\n"
+                    f'{indent}    <MaximumHeartRateBpm xsi:type="HeartRateInBeatsPerMinute_t">\n'
+                    f"{indent}        <Value>{self.max_heart_rate}</Value>\n"
+                    f"{indent}    </MaximumHeartRateBpm>\n"
+                    f"{indent}    <Intensity>{self.intensity}</Intensity>\n"
+                    f"{indent}    <TriggerMethod>{self.trigger_method}</TriggerMethod>\n")
                 for track in self.track_list:
-                    ret += textwrap.indent(track.to_xml(), "    ")
-                ret += format_txt(f"""
-                    </Lap>
-                    """)
-                return ret
+                    track.write(stream, depth + 1)
+                stream.write(f"{indent}</Lap>\n")
 
         id: datetime
         name: str
@@ -177,38 +173,96 @@ class Tcx():
         def add_lap(self, lap: Tcx.Activity.Lap):
             self.lap_list += [lap]
 
-        def to_xml(self):
-            ret = format_txt(f"""
-                <Activity Sport="{self.sport}">
-                    <Id>{self.id.strftime(Tcx.DATETIME_FMT)}</Id>
-                    <Name>{self.name}</Name>
-                """)
+        def write_begin(self, stream: TextIO, depth: int = 0):
+            indent = INDENT * depth
+            stream.write(
+                f'{indent}<Activity Sport="{self.sport}">\n'
+                f"{indent}    <Id>{self.id.strftime(Tcx.DATETIME_FMT)}</Id>\n"
+                f"{indent}    <Name>{self.name}</Name>\n")
+
+        def write_end(self, stream: TextIO, depth: int = 0):
+            stream.write(f"{INDENT * depth}</Activity>\n")
+
+        def write(self, stream: TextIO, depth: int = 0):
+            self.write_begin(stream, depth)
             for lap in self.lap_list:
-                ret += textwrap.indent(lap.to_xml(), "    ")
-            ret += format_txt(f"""
-                </Activity>
-                """)
-            return ret
+                lap.write(stream, depth + 1)
+            self.write_end(stream, depth)
+
+    class Writer():
+        """Incremental export, to use instead of Tcx.export() as a context manager
+
+        Each lap is written as soon as it is complete, so only the lap in
+        progress has to be held in memory, whatever the activity length.
+        The file is written aside and renamed once complete, so that an
+        error leaves no truncated file at out_file_path.
+        """
+
+        def __init__(self, out_file_path: str):
+            self.out_file_path = out_file_path
+            self.tmp_file_path = f"{out_file_path}.tmp"
+            self.out_file: TextIO | None = None
+            self.activity: Tcx.Activity | None = None
+
+        def __enter__(self):
+            self.out_file = open(self.tmp_file_path, "w")
+            Tcx.write_begin(self.out_file)
+            return self
+
+        def __exit__(self, exc_type, exc_value, traceback):
+            try:
+                if exc_type is None:
+                    if self.activity:
+                        self.end_activity()
+                    Tcx.write_end(self.out_file)
+                self.out_file.close()
+            except BaseException:
+                self.out_file.close()
+                os.remove(self.tmp_file_path)
+                raise
+            if exc_type is None:
+                os.replace(self.tmp_file_path, self.out_file_path)
+            else:
+                os.remove(self.tmp_file_path)
+
+        def begin_activity(self, activity: Tcx.Activity):
+            """Write activity header, its laps are then written by add_lap()"""
+            if self.activity:
+                self.end_activity()
+            activity.write_begin(self.out_file, 1)
+            self.activity = activity
+
+        def add_lap(self, lap: Tcx.Activity.Lap):
+            """Write a complete (finalized) lap of current activity"""
+            lap.write(self.out_file, 2)
+
+        def end_activity(self):
+            self.activity.write_end(self.out_file, 1)
+            self.activity = None
 
     activity_list: List[Tcx.Activity] = field(default_factory=list)
 
     def add_activity(self, activity: Tcx.Activity):
         self.activity_list += [activity]
 
-    def to_xml(self):
-        ret = format_txt(f"""
-            <?xml version="1.0" standalone="no" ?>
-            <TrainingCenterDatabase xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:schemaLocation="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2 http://www.garmin.com/xmlschemas/TrainingCenterDatabasev2.xsd">
+    @staticmethod
+    def write_begin(stream: TextIO):
+        stream.write(
+            '<?xml version="1.0" standalone="no" ?>\n'
+            '<TrainingCenterDatabase xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:schemaLocation="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2 http://www.garmin.com/xmlschemas/TrainingCenterDatabasev2.xsd">\n'
+            '\n'
+            '<Activities>\n')
+
+    @staticmethod
+    def write_end(stream: TextIO):
+        stream.write("</Activities>\n")
 
-            <Activities>
-            """)
+    def write(self, stream: TextIO, depth: int = 0):
+        Tcx.write_begin(stream)
         for activity in self.activity_list:
-            ret += textwrap.indent(activity.to_xml(), "    ")
-        ret += format_txt(f"""
-            </Activities>
-            """)
-        return ret
+            activity.write(stream, depth + 1)
+        Tcx.write_end(stream)
 
     def export(self, out_file_path: str):
         with open(out_file_path, "w") as out_file:
-            out_file.write(self.to_xml())
+            self.write(out_file)
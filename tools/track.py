@@ -0,0 +1,73 @@
+
+from __future__ import annotations
+
+from array import array
+from bisect import bisect_right
+from dataclasses import dataclass, field
+import operator
+
+@dataclass
+class Track():
+    """GPS track of a log, points sorted by Time, to locate and interpolate any Time by bisection
+
+    Points are the trkpts of the log, appended as they are converted (position
+    samples, which repeat the previous gps-base one, are not). Between points,
+    the position is linear in Time, before the first and after the last one it
+    is the nearest point.
+    """
+
+    # ms, sample Time base, sorted
+    time_array: array = field(default_factory=lambda: array("q"))
+    # degrees
+    latitude_array: array = field(default_factory=lambda: array("d"))
+    longitude_array: array = field(default_factory=lambda: array("d"))
+
+    def append(self, time: int, latitude: int, longitude: int):
+        """Add a point, position in sample units (1e-7 degrees), sort() once all are added"""
+        self.time_array.append(time)
+        self.latitude_array.append(latitude / 10000000)
+        self.longitude_array.append(longitude / 10000000)
+
+    def sort(self):
+        """Sort points by Time, only needed if samples of the log are not in Time order"""
+        # Stable, points of the same Time stay in log order
+        if any(map(operator.gt, self.time_array, self.time_array[1:])):
+            order = sorted(range(len(self.time_array)), key=self.time_array.__getitem__)
+            self.time_array = array("q", map(self.time_array.__getitem__, order))
+            self.latitude_array = array("d", map(self.latitude_array.__getitem__, order))
+            self.longitude_array = array("d", map(self.longitude_array.__getitem__, order))
+
+    def __len__(self):
+        return len(self.time_array)
+
+    def index(self, time: int):
+        """Index of the last point at or before time, -1 if none"""
+        return bisect_right(self.time_array, time) - 1
+
+    def point(self, index: int):
+        """(lat, lon) of a point"""
+        return self.latitude_array[index], self.longitude_array[index]
+
+    def interpolate(self, index: int, time: int):
+        """(lat, lon) at time, index being the one of the last point at or before it"""
+
+        if index < 0:
+            return self.point(0)
+        if index + 1 >= len(self.time_array):
+            return self.point(index)
+
+        previous_time = self.time_array[index]
+        next_time = self.time_array[index + 1]
+        if next_time <= previous_time or time <= previous_time:
+            return self.point(index)
+
+        # Same ratio for lat and lon
+        ratio = (time - previous_time) / (next_time - previous_time)
+        return (self.latitude_array[index] + (self.latitude_array[index + 1] - self.latitude_array[index]) * ratio,
+            self.longitude_array[index] + (self.longitude_array[index + 1] - self.longitude_array[index]) * ratio)
+
+    def at(self, time: int):
+        """(lat, lon) at time, None if the track is empty, O(log n)"""
+        if not self.time_array:
+            return None
+        return self.interpolate(self.index(time), time)